@@ -1,107 +1,927 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import argparse
+import hashlib
 import io
-import base64
-from PIL import Image
+import json
+import logging
+from PIL import Image, ImageOps
+import openpyxl
+import xlsxwriter
 import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+# Ombor, kesh va o'lchov sinflari alohida modulda: Streamlit uni har rerunda qayta bajarmaydi
+from storage import (
+    ALL_STORES, COLUMNS, DATA_FILE, DB_FILE, NUMERIC_DTYPES, ROLLUP_COLUMNS,
+    ConflictError, CsvStorage, DataCache, Metrics, SqliteStorage,
+    check_version, compact_dtypes, compute_rollups, migrate_csv_to_sqlite
+)
+
+# Kutubxona kodidagi diagnostika (fon oqimlari) shu logger orqali; foydalanuvchi chiqishi faqat run_command da
+logger = logging.getLogger("ombor")
+
 # Papka yaratish funksiyasi
 def create_folders():
     if not os.path.exists("images"):
         os.makedirs("images")
     if not os.path.exists("data"):
         os.makedirs("data")
+    if not os.path.exists(STORES_DIR):
+        os.makedirs(STORES_DIR)
+
+# Ombor turi: "sqlite" (standart) yoki "csv"
+STORAGE_BACKEND = os.environ.get("OMBOR_STORAGE", "sqlite")
+
+# Har bir do'kon ma'lumotlari alohida faylda (dokon_id bo'lmagan qatorlar asosiy faylda qoladi)
+STORES_DIR = "data/dokonlar"
+
+# Ruxsat etilgan toifalar va o'lchamlar
+TOIFA_OPTIONS = ["Erkaklar", "Ayollar", "Bolalar", "Qizlar"]
+OLCHAM_OPTIONS = ["XS", "S", "M", "L", "XL", "XXL", "XXXL"]
+RANG_OPTIONS = ["Qora", "Oq", "Ko'k", "Qizil", "Yashil", "Sariq", "Jigarrang", "Kulrang"]
+
+# Joriy omborni olish (jarayon davomida bitta nusxa)
+@st.cache_resource
+def get_storage(filename=None):
+    if filename is None:
+        filename = DB_FILE if STORAGE_BACKEND == "sqlite" else DATA_FILE
+    if filename.endswith(".db"):
+        storage = SqliteStorage(filename)
+        if filename == DB_FILE:
+            migrate_csv_to_sqlite(DATA_FILE, storage)
+        return storage
+    return CsvStorage(filename)
+
+# Har bir qayta ishga tushirish (rerun) o'lchovlari yoziladigan JSON qatorlar fayli (ixtiyoriy)
+METRICS_LOG = os.environ.get("OMBOR_METRICS_LOG", "")
+
+@st.cache_resource
+def get_metrics():
+    return Metrics()
+
+# Kod blokining vaqtini o'lchash: with timed("load_data") as span: ... (span'ga qo'shimcha maydonlar yozish mumkin)
+def timed(name, **fields):
+    return get_metrics().span(name, **fields)
+
+# Bitta rerun o'lchovlarini JSON qator sifatida faylga qo'shish
+def log_spans(spans, log_file=METRICS_LOG):
+    if not log_file:
+        return
+    with open(log_file, "a") as f:
+        f.write(json.dumps({'vaqt': datetime.now().isoformat(timespec='seconds'), 'spans': spans}) + "\n")
+
+# JSON qatorlar faylidagi o'lchovlarni gistogrammaga yig'ish (CLI uchun)
+def metrics_from_log(log_file):
+    metrics = Metrics()
+    with open(log_file) as f:
+        for line in f:
+            if line.strip():
+                for span in json.loads(line)['spans']:
+                    metrics.observe(span['nom'], span['soniya'])
+    return metrics
+
+@st.cache_resource
+def get_data_cache():
+    return DataCache()
+
+# Omborga yozish: yozuvdan keyin kesh eskirgan deb belgilanadi
+def _write(filename, write):
+    storage = get_storage(filename)
+    try:
+        write(storage)
+    finally:
+        get_data_cache().invalidate(storage)
 
 # Ma'lumotlarni saqlash funksiyasi
-def save_data(df, filename="data/inventory_data.csv"):
-    df.to_csv(filename, index=False)
+# expected_version berilsa va ombor versiyasi boshqacha bo'lsa, ConflictError ko'tariladi
+def save_data(df, filename=None, expected_version=None):
+    with timed("save_data", qatorlar=len(df)):
+        _write(filename, lambda storage: storage.save(df, expected_version))
+
+# Yangi qatorlarni qo'shish funksiyasi (butun faylni qayta yozmasdan)
+def append_data(df, filename=None):
+    with timed("append_data", qatorlar=len(df)):
+        _write(filename, lambda storage: storage.append(df))
+
+# Bitta variantni (mahsulot_id, rang, olcham) yangilash funksiyasi
+def update_variant(product_id, rang, olcham, values, filename=None, expected_version=None):
+    with timed("update_variant"):
+        _write(filename, lambda storage: storage.update_variant((product_id, rang, olcham), values, expected_version))
+
+# Mahsulotning barcha variantlaridagi umumiy ma'lumotlarni yangilash funksiyasi
+def update_product(product_id, values, filename=None, expected_version=None):
+    with timed("update_product"):
+        _write(filename, lambda storage: storage.update_product(product_id, values, expected_version))
+
+# Mahsulotni (barcha variantlari bilan) o'chirish funksiyasi
+def delete_product(product_id, filename=None, expected_version=None):
+    with timed("delete_product"):
+        _write(filename, lambda storage: storage.delete_product(product_id, expected_version))
+
+# rasm_joyi qiymatlarini almashtirish (eski yo'l -> yangi yo'l)
+def rename_images(mapping, filename=None):
+    with timed("rename_images"):
+        _write(filename, lambda storage: storage.rename_images(mapping))
+
+# Mahsulot versiyasi (optimistik tekshiruv uchun)
+def product_version(product_id, filename=None):
+    return get_storage(filename).product_version(product_id)
+
+# Ma'lumotlar versiyasi: har bir yozuvdan keyin o'zgaradi
+def data_version(filename=None):
+    if filename == ALL_STORES:
+        return tuple((name, data_version(name)) for name in store_filenames())
+    return get_data_cache().version(get_storage(filename))
 
 # Ma'lumotlarni yuklash funksiyasi
-def load_data(filename="data/inventory_data.csv"):
+# Natija barcha sessiyalar orasida umumiy: uni o'zgartirishdan oldin nusxa oling
+def load_data(filename=None):
+    if filename == ALL_STORES:
+        return load_all_stores()
+    with timed("load_data") as span:
+        df = get_data_cache().get(get_storage(filename))
+        span['qatorlar'] = len(df)
+        return df
+
+# Kesh yozuvi nomi (derived indekslar uchun)
+def _cache_entry(filename):
+    return ALL_STORES if filename == ALL_STORES else get_storage(filename).filename
+
+# Bo'sh qiymatni (None, NaN, CSV dan o'qilgan 'nan') matn maydoni uchun '' ga aylantirish
+def blank_to_empty(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ''
+    value = str(value).strip()
+    return '' if value.lower() in ('nan', 'none', '<na>') else value
+
+# Do'kon fayli: dokon_id fayl nomiga qaytariladigan tarzda kodlanadi
+# Bo'sh yoki NaN dokon_id asosiy bo'limga tegishli
+def store_filename(dokon_id):
+    dokon_id = blank_to_empty(dokon_id)
+    if dokon_id == '':
+        return None
+    extension = ".db" if STORAGE_BACKEND == "sqlite" else ".csv"
+    return os.path.join(STORES_DIR, urllib.parse.quote(str(dokon_id), safe='') + extension)
+
+# Fayli mavjud do'konlar ro'yxati
+def list_stores():
+    extension = ".db" if STORAGE_BACKEND == "sqlite" else ".csv"
+    if not os.path.isdir(STORES_DIR):
+        return []
+    stores = set()
+    for name in os.listdir(STORES_DIR):
+        # CSV do'kon fayli birinchi birlashtirishgacha faqat jurnaldan iborat bo'lishi mumkin
+        for suffix in [".journal.csv", extension]:
+            if name.endswith(suffix):
+                stores.add(urllib.parse.unquote(name[:-len(suffix)]))
+                break
+    return sorted(stores)
+
+# Barcha bo'limlar: asosiy fayl (do'konsiz qatorlar) va har bir do'kon fayli
+def store_filenames():
+    return [None] + [store_filename(dokon_id) for dokon_id in list_stores()]
+
+# Barcha do'konlar jadvali: faqat so'ralganda, har bir bo'lim keshidan yig'iladi
+def load_all_stores():
+    with timed("load_all_stores") as span:
+        filenames = store_filenames()
+        key = tuple(data_version(name) for name in filenames)
+        
+        def build():
+            frames = [load_data(name) for name in filenames]
+            frames = [frame for frame in frames if not frame.empty] or frames[:1]
+            return compact_dtypes(pd.concat(frames, ignore_index=True))
+        
+        df = get_data_cache().get_merged(key, build)
+        span['qatorlar'] = len(df)
+        return df
+
+# Qatorlarni dokon_id bo'yicha tegishli do'kon fayllariga qo'shish
+def append_by_store(df):
+    stores = df['dokon_id'].astype(object).map(blank_to_empty)
+    for dokon_id, part in df.groupby(stores, sort=False):
+        append_data(part, store_filename(dokon_id))
+
+# Mahsulotni boshqa do'kon fayliga ko'chirish (dokon_id o'zgarganda)
+# Avval yangi joyga yoziladi, keyin eskisidan o'chiriladi: uzilishda qator yo'qolmaydi.
+# O'chirish o'qilgan versiya bilan tekshiriladi: oraliqda kelgan tahrir bo'lsa, ko'chirish bekor qilinadi
+def move_product(product_id, values, filename=None, expected_version=None):
+    version = product_version(product_id, filename)
+    check_version(version, expected_version)
+    df = load_data(filename)
+    rows = df[df['mahsulot_id'] == product_id].astype(object).assign(**values)
+    if rows.empty:
+        raise ConflictError("Ko'chiriladigan mahsulot topilmadi: u o'chirilgan yoki o'zgartirilgan")
+    target = store_filename(values['dokon_id'])
+    if len(get_product_index(load_data(target), target).positions(product_id)):
+        raise ConflictError("Bu mahsulot kodi tanlangan do'konda allaqachon mavjud")
+    append_data(rows, target)
+    try:
+        delete_product(product_id, filename, expected_version=version)
+    except ConflictError:
+        delete_product(product_id, target)
+        raise
+
+# Asosiy fayldagi dokon_id li qatorlarni do'kon fayllariga ko'chirish (takror ishga tushirish xavfsiz)
+def shard_by_store():
+    storage = get_storage()
+    version = storage.version()
+    df = load_data()
+    assigned = df['dokon_id'].astype(object).map(blank_to_empty) != ''
+    if not assigned.any():
+        return 0
+    append_by_store(df[assigned])
+    save_data(df[~assigned], expected_version=version)
+    return int(assigned.sum())
+
+# Ilova ishga tushganda bir marta bo'limlash (boshqa jarayon bilan to'qnashsa, keyingi safar qaytariladi)
+@st.cache_resource
+def _shard_on_start():
+    try:
+        return shard_by_store()
+    except ConflictError:
+        return 0
+
+# Filtrlanadigan ustunlar
+FILTER_COLUMNS = ['toifa', 'rang', 'olcham']
+
+class FilterIndex:
+    """Filtr ustunlari uchun teskari indeks: qiymat -> qatorlar bitmapi
+
+    Har bir ustun kategoriya (Categorical) sifatida kodlanadi, har bir qiymat uchun
+    np.packbits bilan siqilgan bitmap saqlanadi. Filtrlash bitmaplarni kesishtirishdan iborat.
+    """
+
+    def __init__(self, df, columns=FILTER_COLUMNS):
+        self.size = len(df)
+        self.options = {}
+        self.bitmaps = {}
+        for column in columns:
+            values = pd.Categorical(df[column])
+            codes = values.codes
+            self.options[column] = list(values.categories)
+            self.bitmaps[column] = {
+                value: np.packbits(codes == code)
+                for code, value in enumerate(values.categories)
+            }
+
+    def select(self, filters):
+        """Tanlangan qiymatlarga mos qatorlar o'rinlarini qaytaradi (filtr bo'lmasa None)"""
+        mask = None
+        for column, values in filters.items():
+            if not values:
+                continue
+            bitmaps = self.bitmaps[column]
+            column_mask = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+            for value in values:
+                bitmap = bitmaps.get(value)
+                if bitmap is not None:
+                    column_mask |= bitmap
+            mask = column_mask if mask is None else mask & column_mask
+        if mask is None:
+            return None
+        return np.flatnonzero(np.unpackbits(mask, count=self.size))
+
+# Filtr indeksini olish (ma'lumotlar saqlanganda qayta quriladi)
+def get_filter_index(df, filename=None):
+    return get_data_cache().derived(_cache_entry(filename), df, 'filter_index', FilterIndex)
+
+class ProductIndex:
+    """mahsulot_id bo'yicha qator o'rinlari indeksi"""
+
+    def __init__(self, df):
+        self.products = df.groupby('mahsulot_id', sort=False).indices
+        self.product_ids = list(self.products)
+
+    def positions(self, product_id):
+        return self.products.get(product_id, np.array([], dtype=np.intp))
+
+# Mahsulot indeksini olish (ma'lumotlar saqlanganda qayta quriladi)
+def get_product_index(df, filename=None):
+    return get_data_cache().derived(_cache_entry(filename), df, 'product_index', ProductIndex)
+
+# Kichik jadvalga filtrlarni qo'llash (masalan, bitta mahsulot variantlariga)
+def apply_filters(df, filters):
+    for column, values in filters.items():
+        if values:
+            df = df[df[column].isin(values)]
+    return df
+
+# Jadval sahifasidagi qatorlar soni variantlari
+PAGE_SIZES = [25, 50, 100, 500]
+
+# Berilgan o'rinlardagi qatorlar (o'rinlar bo'lmasa butun jadval)
+def take_rows(df, positions):
+    return df if positions is None else df.iloc[positions]
+
+# Butun jadval uchun saralash tartibi (qatorlar o'rinlari)
+def _sort_order(df, column, ascending):
+    values = df[column].reset_index(drop=True)
+    return values.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+
+# Jadvalning bitta sahifasi: faqat shu sahifadagi qatorlar olinadi
+def get_page(df, positions, page, page_size, sort_column=None, ascending=True, filename=None):
+    start = (page - 1) * page_size
+    if sort_column is None:
+        if positions is None:
+            return df.iloc[start:start + page_size]
+        return df.iloc[positions[start:start + page_size]]
+    
+    # Saralash tartibi har bir ma'lumotlar versiyasi uchun bir marta hisoblanadi
+    order = get_data_cache().derived(
+        _cache_entry(filename), df, ('sort', sort_column, ascending),
+        lambda df: _sort_order(df, sort_column, ascending)
+    )
+    if positions is not None:
+        selected = np.zeros(len(df), dtype=bool)
+        selected[positions] = True
+        order = order[selected[order]]
+    return df.iloc[order[start:start + page_size]]
+
+# Hisobot jadvali: ombor o'zi beradi (SQLite - triggerlar yuritadigan jadval, CSV - har bir versiya uchun hisob)
+def get_rollups(filename=None):
+    if filename == ALL_STORES:
+        # Do'konlar yig'ma jadvallari kichik: ularni qo'shish butun jadvalni yig'ishdan arzon
+        frames = [get_rollups(name) for name in store_filenames()]
+        return (
+            pd.concat(frames, ignore_index=True)
+            .groupby(['ustun', 'qiymat'], as_index=False, sort=False)[['miqdor', 'summa', 'qatorlar']].sum()
+        )
+    storage = get_storage(filename)
+    df = load_data(filename)
+    return get_data_cache().derived(_cache_entry(filename), df, 'rollups', storage.rollups)
+
+# Bitta ustun bo'yicha hisobot (qiymat kamayishi tartibida)
+def rollup_table(rollups, column):
+    table = rollups[rollups['ustun'] == column].drop(columns='ustun')
+    return table.sort_values('summa', ascending=False, kind='stable').reset_index(drop=True)
+
+# Rasmlar mazmuni (sha256) bo'yicha nomlanadi: bir xil rasm bir marta saqlanadi
+IMAGE_DIR = "images"
+# Shu muddatdan yangi fayllar yig'ishtirishda (gc) o'chirilmaydi: qatori hali yozilmagan bo'lishi mumkin
+IMAGE_GC_GRACE_SECONDS = 3600
+
+# Kichik nusxalar (thumbnail) sozlamalari
+THUMBNAIL_DIR = "images/thumbs"
+THUMBNAIL_SIZE = (600, 600)
+THUMBNAIL_QUALITY = 80
+SAVE_WEBP = os.environ.get("OMBOR_WEBP", "") == "1"
+IMAGE_CACHE_SIZE = 256
+
+# Rasmlarni fon rejimida qayta ishlash sozlamalari
+IMAGE_WORKERS = 2
+IMAGE_QUEUE_SIZE = 16
+
+# Rasmning kichik nusxasi yo'li
+def thumbnail_path(image_path, ext=".jpg"):
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(THUMBNAIL_DIR, name + ext)
+
+# Rasmni JPEG uchun tayyorlash (EXIF bo'yicha burish, RGB rejimi)
+def prepare_image(image):
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    return image
+
+# Rasmni vaqtinchalik faylga yozib, so'ng almashtirish (chala fayl ko'rinmasligi uchun)
+# Vaqtinchalik nom har safar yangi: bir xil rasmni bir vaqtda yozayotganlar bir-birining faylini buzmaydi
+def _save_atomic(image, path, format, **options):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        image.save(tmp_path, format, **options)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# Kichik nusxa yaratish funksiyasi
+def save_thumbnail(image, image_path):
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    thumb = image.copy()
+    thumb.thumbnail(THUMBNAIL_SIZE, Image.LANCZOS)
+    thumb = prepare_image(thumb)
+    path = thumbnail_path(image_path)
+    _save_atomic(thumb, path, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+    if SAVE_WEBP:
+        _save_atomic(thumb, thumbnail_path(image_path, ".webp"), "WEBP", quality=THUMBNAIL_QUALITY)
+    return path
+
+# Rasm yo'li mazmun xeshidan olinadi
+def content_image_path(digest):
+    return f"{IMAGE_DIR}/{digest}.jpg"
+
+# Rasm xeshi: har doim manba baytlaridan (yuklangan fayl yoki diskdagi fayl)
+def image_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+# Bunday rasm bormi; bo'lsa, vaqti yangilanadi (gc yangi havola qilingan faylni o'chirmasligi uchun)
+def _reuse_image(image_path):
     try:
-        return pd.read_csv(filename)
+        os.utime(image_path)
     except FileNotFoundError:
-        # Agar fayl topilmasa, yangi DataFrame yaratamiz
-        return pd.DataFrame({
-            'mahsulot_id': [],
-            'mahsulot_nomi': [],
-            'rasm_joyi': [],
-            'toifa': [],
-            'davlat': [],
-            'dokon_id': [],
-            'omborchi': [],
-            'rang': [],
-            'olcham': [],
-            'miqdor': [],
-            'narx': []
-        })
-
-# Rasmni saqlash funksiyasi
-def save_image(image, product_id):
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    image_path = f"images/{product_id}_{timestamp}.jpg"
-    image.save(image_path)
+        return False
+    return True
+
+# Mazmun bo'yicha nomlangan rasmmi (eski rasmlar mahsulot_id_vaqt.jpg ko'rinishida)
+def is_content_image(image_path):
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    return len(name) == 64 and all(c in "0123456789abcdef" for c in name)
+
+# Rasmni va uning kichik nusxasini berilgan yo'lga yozish
+def write_image(image, image_path):
+    with timed("save_image"):
+        image = prepare_image(image)
+        _save_atomic(image, image_path, "JPEG")
+        save_thumbnail(image, image_path)
     return image_path
 
+# Rasmni saqlash funksiyasi (rasm fayli baytlari; bunday rasm bo'lsa, qayta yozilmaydi)
+def save_image(data):
+    image_path = content_image_path(image_digest(data))
+    if _reuse_image(image_path):
+        return image_path
+    with Image.open(io.BytesIO(data)) as image:
+        return write_image(image, image_path)
+
+class ImageWorker:
+    """Rasmlarni (ochish, burish, kichraytirish, kodlash) fon oqimlarida qayta ishlaydi
+
+    Navbat IMAGE_QUEUE_SIZE bilan cheklangan: navbat to'lsa, yangi ish bo'sh joy kutadi.
+    """
+
+    def __init__(self, workers=IMAGE_WORKERS, queue_size=IMAGE_QUEUE_SIZE):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rasm")
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.processed = 0
+        self.failed = 0
+        # Qayta ishlab bo'lmagan rasmlar: yo'l -> xatolik matni (sahifada ko'rsatish uchun)
+        self.failed_paths = {}
+        self.total_seconds = 0.0
+        self.last_seconds = 0.0
+
+    def submit(self, data, image_path):
+        """Ishni navbatga qo'yadi; shu yo'l allaqachon navbatda bo'lsa, None qaytaradi"""
+        self.slots.acquire()
+        # Tekshiruv va navbatga qo'yish bitta qulf ostida: bir xil rasm ikki marta yozilmaydi
+        with self.lock:
+            if image_path in self.pending:
+                self.slots.release()
+                return None
+            self.pending[image_path] = time.time()
+            self.failed_paths.pop(image_path, None)
+            try:
+                return self.executor.submit(self._process, data, image_path)
+            except Exception:
+                del self.pending[image_path]
+                self.slots.release()
+                raise
+
+    def _process(self, data, image_path):
+        start = time.perf_counter()
+        error = None
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                write_image(image, image_path)
+        except Image.UnidentifiedImageError:
+            error = "fayl rasm emas yoki buzilgan"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            logger.exception("Rasmni qayta ishlashda xatolik (%s)", image_path)
+        finally:
+            self._finish(image_path, time.perf_counter() - start, error)
+
+    def _finish(self, image_path, seconds, error=None):
+        with self.lock:
+            self.pending.pop(image_path, None)
+            if error is not None:
+                self.failed += 1
+                self.failed_paths[image_path] = error
+            else:
+                self.processed += 1
+                self.total_seconds += seconds
+                self.last_seconds = seconds
+        self.slots.release()
+
+    def is_pending(self, image_path):
+        with self.lock:
+            return image_path in self.pending
+
+    def failure(self, image_path):
+        """Rasm qayta ishlanmagan bo'lsa, xatolik matnini qaytaradi, aks holda None"""
+        with self.lock:
+            return self.failed_paths.get(image_path)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'navbatda': len(self.pending),
+                'bajarildi': self.processed,
+                'xatolar': self.failed,
+                'oxirgi_soniya': self.last_seconds,
+                'ortacha_soniya': self.total_seconds / self.processed if self.processed else 0.0
+            }
+
+@st.cache_resource
+def get_image_worker():
+    return ImageWorker()
+
+# Yuklangan rasmni fon rejimida saqlash: yo'l darhol qaytadi, fayl keyinroq paydo bo'ladi
+# Xesh yuklangan fayl baytlaridan olinadi: qayta yuklangan rasm ochilmaydi ham, yozilmaydi ham
+def save_image_async(uploaded_file):
+    data = uploaded_file.getvalue()
+    image_path = content_image_path(image_digest(data))
+    if not _reuse_image(image_path):
+        get_image_worker().submit(data, image_path)
+    return image_path
+
+# Rasmlarga havolalar soni: nechta mahsulot (barcha do'konlarda) shu rasm_joyi ni ishlatadi
+def image_references():
+    references = {}
+    for name in store_filenames():
+        products = load_data(name).drop_duplicates('mahsulot_id')
+        for image_path in products['rasm_joyi'].dropna().astype(str):
+            if image_path:
+                image_path = os.path.normpath(image_path)
+                references[image_path] = references.get(image_path, 0) + 1
+    return references
+
+# Faylni yangi nomga bog'lash (qattiq havola, bo'lmasa nusxa)
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+# Eski (mahsulot_id_vaqt.jpg) rasmlarni mazmun bo'yicha nomlarga ko'chirish va rasm_joyi ni yangilash
+# Eski fayllar o'chirilmaydi: havolasiz qolgani uchun keyingi gc ularni tozalaydi
+def migrate_images():
+    mapping = {}
+    for image_path in image_references():
+        if is_content_image(image_path) or not os.path.exists(image_path):
+            continue
+        with open(image_path, "rb") as f:
+            target = content_image_path(image_digest(f.read()))
+        if not _reuse_image(target):
+            _link_or_copy(image_path, target)
+        for ext in [".jpg", ".webp"]:
+            thumb = thumbnail_path(image_path, ext)
+            if os.path.exists(thumb) and not os.path.exists(thumbnail_path(target, ext)):
+                _link_or_copy(thumb, thumbnail_path(target, ext))
+        mapping[image_path] = target
+    if mapping:
+        for name in store_filenames():
+            rename_images(mapping, name)
+    return len(mapping)
+
+# Hech bir mahsulot ishlatmaydigan rasmlar va ularning kichik nusxalarini o'chirish
+def collect_garbage_images(dry_run=False, grace_seconds=IMAGE_GC_GRACE_SECONDS):
+    references = image_references()
+    worker = get_image_worker()
+    cutoff = time.time() - grace_seconds
+    result = {'fayllar': 0, 'baytlar': 0}
+    
+    def remove(path, size):
+        result['fayllar'] += 1
+        result['baytlar'] += size
+        if not dry_run:
+            os.remove(path)
+    
+    originals = set()
+    for entry in os.scandir(IMAGE_DIR):
+        if not entry.is_file():
+            continue
+        name = os.path.splitext(entry.name)[0]
+        if entry.stat().st_mtime > cutoff:
+            originals.add(name)
+        # Uzilib qolgan yozuvlardan qolgan .tmp fayllar ham o'chiriladi
+        elif entry.name.endswith(".tmp") or (
+            entry.name.endswith(".jpg") and os.path.normpath(entry.path) not in references and not worker.is_pending(content_image_path(name))
+        ):
+            remove(entry.path, entry.stat().st_size)
+        else:
+            originals.add(name)
+    # Asl rasmi qolmagan kichik nusxalar
+    if os.path.isdir(THUMBNAIL_DIR):
+        for entry in os.scandir(THUMBNAIL_DIR):
+            if entry.is_file() and entry.stat().st_mtime <= cutoff and os.path.splitext(entry.name)[0] not in originals:
+                remove(entry.path, entry.stat().st_size)
+    return result
+
+# Kichik nusxa baytlari keshi (eng ko'p IMAGE_CACHE_SIZE ta, LRU)
+@st.cache_resource(max_entries=IMAGE_CACHE_SIZE)
+def _read_thumbnail(path, mtime_ns):
+    with open(path, "rb") as f:
+        return f.read()
+
+# Ko'rsatish uchun rasm: asl rasm o'rniga kichik nusxa qaytariladi
+def load_display_image(image_path):
+    with timed("load_display_image"):
+        thumb = thumbnail_path(image_path)
+        if not os.path.exists(thumb):
+            if not os.path.exists(image_path) or get_image_worker().is_pending(image_path):
+                return None
+            # Eski rasmlar uchun kichik nusxa birinchi ko'rishda yaratiladi
+            with Image.open(image_path) as image:
+                image.draft("RGB", THUMBNAIL_SIZE)
+                save_thumbnail(image, image_path)
+        return _read_thumbnail(thumb, os.stat(thumb).st_mtime_ns)
+
+# Excel eksport sozlamalari
+EXCEL_CHUNK_ROWS = 10000
+EXCEL_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_CACHE_DIR = "data/exports"
+EXPORT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Bitta sheetni qatorma-qator yozish (constant_memory rejimi tartib bilan yozishni talab qiladi)
+def _write_sheet(workbook, sheet_name, df, header_format):
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, list(df.columns), header_format)
+    row = 1
+    for start in range(0, len(df), EXCEL_CHUNK_ROWS):
+        chunk = df.iloc[start:start + EXCEL_CHUNK_ROWS]
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for values in chunk.itertuples(index=False, name=None):
+            worksheet.write_row(row, 0, values)
+            row += 1
+    return worksheet
+
+# Hisobot sheet'i: ustunlar ketma-ket bloklar sifatida yoziladi
+def _write_summary_sheet(workbook, rollups, header_format):
+    worksheet = workbook.add_worksheet('Hisobot')
+    totals = rollups[rollups['ustun'] == ROLLUP_COLUMNS[0]][['miqdor', 'summa', 'qatorlar']].sum()
+    worksheet.write_row(0, 0, ['Jami miqdor', 'Jami qiymat', 'Qatorlar'], header_format)
+    worksheet.write_row(1, 0, [int(totals['miqdor']), int(totals['summa']), int(totals['qatorlar'])])
+    row = 3
+    for column in ROLLUP_COLUMNS:
+        table = rollup_table(rollups, column)
+        worksheet.write_row(row, 0, [column, 'miqdor', 'summa', 'qatorlar'], header_format)
+        row += 1
+        for record in table.itertuples(index=False, name=None):
+            worksheet.write_row(row, 0, [record[0], int(record[1]), int(record[2]), int(record[3])])
+            row += 1
+        row += 1
+    return worksheet
+
 # Excel faylni yuklash funksiyasi
-def to_excel(df, filename="omborxona_malumotlari.xlsx"):
-    output = io.BytesIO()
-    writer = pd.ExcelWriter(output, engine='xlsxwriter')
+# Fayl diskka yoziladi (xlsxwriter constant_memory), xotirada butun kitob saqlanmaydi
+def to_excel(df, filename=None):
+    if filename is None:
+        fd, filename = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+    with timed("to_excel", qatorlar=len(df)):
+        workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+        try:
+            header_format = workbook.add_format({'bold': True, 'border': 1})
+            
+            # Umumiy hisobot: har bir ustun bo'yicha miqdor va qiymat (Excel'da pivot qilish shart emas)
+            _write_summary_sheet(workbook, compute_rollups(df), header_format)
+            
+            # Barcha ma'lumotlar uchun sheet
+            _write_sheet(workbook, 'Barcha_Malumotlar', df, header_format)
+            
+            # Toifalar bo'yicha sheets (bitta groupby o'tishi bilan)
+            for toifa, toifa_df in df.groupby('toifa', sort=False, observed=True):
+                _write_sheet(workbook, f'Toifa_{toifa}', toifa_df, header_format)
+            
+            # Mahsulot ID va rasmlar uchun sheet
+            id_rasm_df = df[['mahsulot_id', 'rasm_joyi']].drop_duplicates()
+            _write_sheet(workbook, 'ID_va_Rasmlar', id_rasm_df, header_format)
+        finally:
+            workbook.close()
+    return filename
+
+class ExportCache:
+    """Tayyor Excel fayllarining diskdagi keshi
+
+    Fayllar ma'lumotlar versiyasi va filtrlar xeshi bilan nomlanadi. Umumiy hajm
+    max_bytes dan oshsa, eng uzoq ishlatilmagan fayllar o'chiriladi (LRU).
+    """
+
+    def __init__(self, folder=EXPORT_CACHE_DIR, max_bytes=EXPORT_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.folder, key + ".xlsx")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            # Oxirgi ishlatilgan vaqtni yangilash (LRU uchun)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, df):
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        os.close(fd)
+        try:
+            to_excel(df, tmp_path)
+            os.replace(tmp_path, self.path(key))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._evict(keep=self.path(key))
+        return self.path(key)
+
+    def _evict(self, keep=None):
+        with self.lock:
+            files = []
+            for entry in os.scandir(self.folder):
+                if entry.name.endswith(".xlsx"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+@st.cache_resource
+def get_export_cache():
+    return ExportCache()
+
+# Eksport kaliti: manba (do'kon fayli yoki barcha do'konlar), ma'lumotlar versiyasi va tanlangan filtrlar xeshi
+def export_cache_key(filename, version, filters):
+    filters = [sorted(str(value) for value in values) for values in filters]
+    return hashlib.sha256(repr((_cache_entry(filename), version, filters)).encode("utf-8")).hexdigest()
+
+# Excel yuklab olish tugmasi
+def excel_download_button(make_df, export_key, filename="omborxona_malumotlari.xlsx"):
+    """Excel fayl faqat so'ralganda make_df() natijasidan tayyorlanadi; bir xil kalit uchun keshdagi fayl qayta ishlatiladi"""
+    cache = get_export_cache()
+    path = cache.get(export_key)
+    if path is None and st.button("Excel faylni tayyorlash"):
+        path = cache.put(export_key, make_df())
     
-    # Barcha ma'lumotlar uchun sheet
-    df.to_excel(writer, sheet_name='Barcha_Malumotlar', index=False)
+    if path is not None:
+        # Fayl faqat tugma bosilganda o'qiladi: har bir rerunda butun kitob xotiraga olinmaydi (Streamlit 1.52+)
+        def read_file():
+            with open(path, "rb") as f:
+                return f.read()
+        st.download_button("Excel faylni yuklab olish", read_file, file_name=filename, mime=EXCEL_MIME)
+
+# Ommaviy import sozlamalari
+IMPORT_CHUNK_ROWS = 5000
+IMPORT_MAX_ERRORS = 1000
+IMPORT_REQUIRED_COLUMNS = ['mahsulot_id', 'mahsulot_nomi', 'toifa', 'rang', 'olcham', 'miqdor', 'narx']
+
+# Import faylini bo'laklab o'qish (CSV yoki XLSX), butun fayl xotiraga yuklanmaydi
+def read_import_chunks(source, chunksize=IMPORT_CHUNK_ROWS):
+    name = str(getattr(source, 'name', source)).lower()
+    if name.endswith((".xlsx", ".xlsm")):
+        workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = ['' if cell is None else str(cell).strip() for cell in next(rows, ())]
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= chunksize:
+                    yield pd.DataFrame(batch, columns=header)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=header)
+        finally:
+            workbook.close()
+    else:
+        for chunk in pd.read_csv(source, chunksize=chunksize, dtype=str):
+            chunk.columns = [str(column).strip() for column in chunk.columns]
+            yield chunk
+
+# Bo'lakni tekshirish: to'g'ri qatorlar va xatolar ro'yxatini qaytaradi
+def validate_import_chunk(chunk, first_row, max_errors=IMPORT_MAX_ERRORS):
+    missing = [column for column in IMPORT_REQUIRED_COLUMNS if column not in chunk.columns]
+    if missing:
+        raise ValueError(f"Faylda ustunlar yetishmayapti: {', '.join(missing)}")
     
-    # Toifalar bo'yicha sheets
-    toifalar = df['toifa'].unique()
-    for toifa in toifalar:
-        toifa_df = df[df['toifa'] == toifa]
-        toifa_df.to_excel(writer, sheet_name=f'Toifa_{toifa}', index=False)
+    chunk = chunk.reindex(columns=COLUMNS).reset_index(drop=True)
+    for column in COLUMNS:
+        if column in NUMERIC_DTYPES:
+            chunk[column] = pd.to_numeric(chunk[column], errors='coerce')
+        else:
+            values = chunk[column]
+            values = values.where(values.isna(), values.astype(str).str.strip())
+            chunk[column] = values.replace('', np.nan)
     
-    # Mahsulot ID va rasmlar uchun sheet
-    id_rasm_df = df[['mahsulot_id', 'rasm_joyi']].drop_duplicates()
-    id_rasm_df.to_excel(writer, sheet_name='ID_va_Rasmlar', index=False)
+    checks = [
+        (chunk['mahsulot_id'].isna(), "mahsulot_id bo'sh"),
+        (chunk['mahsulot_nomi'].isna(), "mahsulot_nomi bo'sh"),
+        (chunk['rang'].isna(), "rang bo'sh"),
+        (~chunk['toifa'].isin(TOIFA_OPTIONS), f"toifa quyidagilardan biri bo'lishi kerak: {', '.join(TOIFA_OPTIONS)}"),
+        (~chunk['olcham'].isin(OLCHAM_OPTIONS), f"olcham quyidagilardan biri bo'lishi kerak: {', '.join(OLCHAM_OPTIONS)}"),
+    ]
+    for column in NUMERIC_DTYPES:
+        values = chunk[column]
+        checks.append((values.isna(), f"{column} son bo'lishi kerak"))
+        checks.append((values < 0, f"{column} manfiy bo'lmasligi kerak"))
+        checks.append((values.notna() & (values % 1 != 0), f"{column} butun son bo'lishi kerak"))
     
-    writer.close()
-    processed_data = output.getvalue()
-    return processed_data
-
-# Download link funksiyasi
-def get_download_link(df, filename="omborxona_malumotlari.xlsx"):
-    """Excel faylni yuklab olish uchun link yaratadi"""
-    val = to_excel(df)
-    b64 = base64.b64encode(val).decode()
-    return f'<a href="data:application/octet-stream;base64,{b64}" download="{filename}">Excel faylni yuklab olish</a>'
-
-# Asosiy dastur
-def main():
+    bad = np.zeros(len(chunk), dtype=bool)
+    errors = []
+    for mask, message in checks:
+        mask = mask.to_numpy(dtype=bool)
+        bad |= mask
+        for i in np.flatnonzero(mask)[:max(0, max_errors - len(errors))]:
+            # Fayldagi qator raqami (sarlavha 1-qator)
+            errors.append({'qator': first_row + int(i), 'xato': message})
+    
+    errors.sort(key=lambda error: error['qator'])
+    valid = chunk[~bad].astype({column: 'Int64' for column in NUMERIC_DTYPES})
+    return valid, int(bad.sum()), errors
+
+# Ommaviy import: bo'laklab o'qiladi, tekshiriladi va (mahsulot_id, rang, olcham) bo'yicha yoziladi
+def import_inventory(source, filename=None, chunksize=IMPORT_CHUNK_ROWS, max_errors=IMPORT_MAX_ERRORS):
+    report = {'jami': 0, 'yuklandi': 0, 'xato_qatorlar': 0, 'xatolar': []}
+    for chunk in read_import_chunks(source, chunksize):
+        valid, bad_count, errors = validate_import_chunk(
+            chunk, report['jami'] + 2, max_errors - len(report['xatolar'])
+        )
+        if not valid.empty:
+            # Fayl berilmasa, qatorlar dokon_id bo'yicha do'kon fayllariga yoziladi
+            if filename is None:
+                append_by_store(valid)
+            else:
+                append_data(valid, filename)
+        report['jami'] += len(chunk)
+        report['yuklandi'] += len(valid)
+        report['xato_qatorlar'] += bad_count
+        report['xatolar'].extend(errors)
+    return report
+
+# Sahifani chizish
+def render_page():
     create_folders()
     
     st.set_page_config(page_title="Omborxona Boshqarish Tizimi", layout="wide")
     
     st.title("Omborxona Boshqarish Tizimi")
-    
-    # Inventar ma'lumotlarini yuklash
-    inventory_data = load_data()
+    _shard_on_start()
     
     # Sidebar - Amal tanlash
     st.sidebar.title("Boshqarish paneli")
-    action = st.sidebar.radio("Tanlang:", ["Mahsulot qo'shish", "Mahsulotlarni ko'rish", "Mahsulotni tahrirlash"])
+    action = st.sidebar.radio("Tanlang:", ["Mahsulot qo'shish", "Mahsulotlarni ko'rish", "Mahsulotni tahrirlash", "Hisobot", "Ommaviy import"])
+    
+    # Rasm navbati holati
+    image_stats = get_image_worker().stats()
+    if image_stats['navbatda'] or image_stats['bajarildi']:
+        st.sidebar.caption(
+            f"Rasm navbati: {image_stats['navbatda']} ta, "
+            f"o'rtacha {image_stats['ortacha_soniya']:.2f} s"
+        )
     
     # Umumiy ma'lumotlar (barcha mahsulotlar uchun bir xil)
-    if action in ["Mahsulot qo'shish"]:
-        with st.sidebar.expander("Umumiy ma'lumotlar", expanded=True):
-            dokon_id = st.text_input("Do'kon ID", value=st.session_state.get('dokon_id', ''))
+    # Do'kon ID joriy do'konni ham belgilaydi: o'qish va yozish faqat shu do'kon faylida
+    # Kalitli maydon: qiymat to'g'ridan-to'g'ri session_state['dokon_id'] da, bo'sh qoldirish ham mumkin
+    # (boshqa joydan o'zgartirish uchun 'dokon_id_keyingi' ga yoziladi, maydon chizilishidan oldin o'tkaziladi)
+    if 'dokon_id_keyingi' in st.session_state:
+        st.session_state['dokon_id'] = st.session_state.pop('dokon_id_keyingi')
+    with st.sidebar.expander("Umumiy ma'lumotlar", expanded=action == "Mahsulot qo'shish"):
+        st.text_input("Do'kon ID", key='dokon_id')
+        if action in ["Mahsulot qo'shish"]:
             omborchi = st.text_input("Omborchi ismi", value=st.session_state.get('omborchi', ''))
             davlat = st.text_input("Ishlab chiqarilgan davlat", value=st.session_state.get('davlat', ''))
-            
-            # Session state'ga saqlash
-            if dokon_id:
-                st.session_state['dokon_id'] = dokon_id
-            if omborchi:
-                st.session_state['omborchi'] = omborchi
-            if davlat:
-                st.session_state['davlat'] = davlat
+        else:
+            omborchi = davlat = None
+        
+        # Session state'ga saqlash
+        if omborchi:
+            st.session_state['omborchi'] = omborchi
+        if davlat:
+            st.session_state['davlat'] = davlat
+        
+        stores = list_stores()
+        if stores:
+            st.caption(f"Do'konlar: {', '.join(stores)}")
+    
+    # Joriy do'kon ma'lumotlarini yuklash (boshqa do'konlar fayllari o'qilmaydi)
+    store_file = store_filename(st.session_state.get('dokon_id', ''))
+    view_file = store_file
+    if action in ["Mahsulotlarni ko'rish", "Hisobot"] and st.sidebar.checkbox("Barcha do'konlar"):
+        view_file = ALL_STORES
+    inventory_data = load_data(view_file)
     
     # Mahsulot qo'shish
     if action == "Mahsulot qo'shish":
@@ -112,7 +932,7 @@ def main():
         with col1:
             mahsulot_id = st.text_input("Mahsulot kodi", key="m_id")
             mahsulot_nomi = st.text_input("Mahsulot nomi", key="m_nomi")
-            toifa = st.selectbox("Toifa", ["Erkaklar", "Ayollar", "Bolalar", "Qizlar"], key="toifa")
+            toifa = st.selectbox("Toifa", TOIFA_OPTIONS, key="toifa")
             
             # Rasm yuklash
             uploaded_file = st.file_uploader("Mahsulot rasmini yuklang", type=["jpg", "jpeg", "png"])
@@ -134,7 +954,7 @@ def main():
             st.subheader("Ranglar va o'lchamlar")
             
             # Ranglar ro'yxati
-            available_colors = ["Qora", "Oq", "Ko'k", "Qizil", "Yashil", "Sariq", "Jigarrang", "Kulrang"]
+            available_colors = list(RANG_OPTIONS)
             
             # Yangi rang qo'shish
             new_color = st.text_input("Yangi rang qo'shish (ixtiyoriy)")
@@ -149,8 +969,7 @@ def main():
             selected_color = st.selectbox("Rang tanlang", available_colors)
             
             # O'lchamlar
-            olcham_options = ["XS", "S", "M", "L", "XL", "XXL", "XXXL"]
-            olcham = st.selectbox("O'lcham", olcham_options)
+            olcham = st.selectbox("O'lcham", OLCHAM_OPTIONS)
             miqdor = st.number_input("Miqdor", min_value=0, step=1)
             narx = st.number_input("Narx", min_value=0, step=1000)
             
@@ -181,9 +1000,8 @@ def main():
             if not mahsulot_id or not mahsulot_nomi or not uploaded_file or not st.session_state.selected_colors:
                 st.error("Iltimos, barcha zarur ma'lumotlarni to'ldiring!")
             else:
-                # Rasmni saqlash
-                image = Image.open(uploaded_file)
-                image_path = save_image(image, mahsulot_id)
+                # Rasmni saqlash (fon rejimida, qator darhol yoziladi)
+                image_path = save_image_async(uploaded_file)
                 
                 # Yangi qatorlar yaratish
                 new_rows = []
@@ -202,54 +1020,75 @@ def main():
                         'narx': item['narx']
                     })
                 
-                # Ma'lumotlarni yangilash
-                new_data = pd.DataFrame(new_rows)
-                inventory_data = pd.concat([inventory_data, new_data], ignore_index=True)
-                save_data(inventory_data)
+                # Ma'lumotlarni yangilash (faqat yangi qatorlar, do'kon fayliga yoziladi)
+                append_by_store(pd.DataFrame(new_rows))
                 
                 st.success("Mahsulot muvaffaqiyatli saqlandi!")
                 st.session_state.selected_colors = []  # Ranglar ro'yxatini tozalash
                 
                 # Formani tozalash (refresh qilish)
-                st.experimental_rerun()
+                st.rerun()
     
     # Mahsulotlarni ko'rish
     elif action == "Mahsulotlarni ko'rish":
-        st.header("Barcha mahsulotlar")
+        if view_file == ALL_STORES:
+            st.header("Barcha do'konlar mahsulotlari")
+        else:
+            st.header(f"Do'kon mahsulotlari: {st.session_state.get('dokon_id', '')}")
         
         if inventory_data.empty:
             st.warning("Hozircha ma'lumotlar mavjud emas")
         else:
-            # Filtrlar
+            # Filtrlar (variantlar indeksdan olinadi)
+            filter_index = get_filter_index(inventory_data, view_file)
             col1, col2, col3 = st.columns(3)
             with col1:
-                filter_toifa = st.multiselect("Toifa bo'yicha saralash", options=inventory_data['toifa'].unique())
+                filter_toifa = st.multiselect("Toifa bo'yicha saralash", options=filter_index.options['toifa'])
             with col2:
-                filter_rang = st.multiselect("Rang bo'yicha saralash", options=inventory_data['rang'].unique())
+                filter_rang = st.multiselect("Rang bo'yicha saralash", options=filter_index.options['rang'])
             with col3:
-                filter_olcham = st.multiselect("O'lcham bo'yicha saralash", options=inventory_data['olcham'].unique())
+                filter_olcham = st.multiselect("O'lcham bo'yicha saralash", options=filter_index.options['olcham'])
+            
+            # Filter qo'llash (bitmaplar kesishmasi, to'liq nusxasiz)
+            filters = {'toifa': filter_toifa, 'rang': filter_rang, 'olcham': filter_olcham}
+            positions = filter_index.select(filters)
+            total = len(inventory_data) if positions is None else len(positions)
             
-            # Filter qo'llash
-            filtered_data = inventory_data.copy()
-            if filter_toifa:
-                filtered_data = filtered_data[filtered_data['toifa'].isin(filter_toifa)]
-            if filter_rang:
-                filtered_data = filtered_data[filtered_data['rang'].isin(filter_rang)]
-            if filter_olcham:
-                filtered_data = filtered_data[filtered_data['olcham'].isin(filter_olcham)]
+            # Natijalarni ko'rsatish (brauzerga faqat joriy sahifa yuboriladi)
+            st.write(f"Jami {total} ta mahsulot topildi")
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                sort_column = st.selectbox(
+                    "Saralash ustuni",
+                    [None] + COLUMNS,
+                    format_func=lambda column: "Saralanmagan" if column is None else column
+                )
+            with col2:
+                ascending = st.checkbox("O'sish tartibida", value=True)
+            with col3:
+                page_size = st.selectbox("Sahifadagi qatorlar", PAGE_SIZES)
+            page_count = max(1, -(-total // page_size))
+            with col4:
+                page = st.number_input("Sahifa", min_value=1, max_value=page_count, value=1, step=1)
             
-            # Natijalarni ko'rsatish
-            st.write(f"Jami {len(filtered_data)} ta mahsulot topildi")
-            st.dataframe(filtered_data)
+            st.dataframe(get_page(inventory_data, positions, page, page_size, sort_column, ascending, view_file))
+            st.caption(f"{page} / {page_count} sahifa")
             
-            # Excel yuklab olish
-            st.markdown(get_download_link(filtered_data), unsafe_allow_html=True)
+            # Excel yuklab olish (filtrlangan jadval faqat fayl tayyorlanayotganda yig'iladi)
+            export_key = export_cache_key(view_file, data_version(view_file), [filter_toifa, filter_rang, filter_olcham])
+            excel_download_button(lambda: take_rows(inventory_data, positions), export_key)
             
             # Mahsulot detallarini ko'rish
-            selected_product_id = st.selectbox("Mahsulot detallarini ko'rish", options=filtered_data['mahsulot_id'].unique())
+            product_index = get_product_index(inventory_data, view_file)
+            if positions is None:
+                product_options = product_index.product_ids
+            else:
+                product_options = pd.unique(inventory_data['mahsulot_id'].to_numpy()[positions])
+            selected_product_id = st.selectbox("Mahsulot detallarini ko'rish", options=product_options)
             
             if selected_product_id:
-                product_details = filtered_data[filtered_data['mahsulot_id'] == selected_product_id]
+                product_details = inventory_data.iloc[product_index.positions(selected_product_id)]
+                product_details = apply_filters(product_details, filters)
                 
                 col1, col2 = st.columns(2)
                 
@@ -264,10 +1103,14 @@ def main():
                 with col2:
                     # Rasmni ko'rsatish
                     try:
-                        image_path = product_details['rasm_joyi'].iloc[0]
-                        if os.path.exists(image_path):
-                            image = Image.open(image_path)
+                        image_path = blank_to_empty(product_details['rasm_joyi'].iloc[0])
+                        image = load_display_image(image_path)
+                        if image is not None:
                             st.image(image, caption='Mahsulot rasmi', width=300)
+                        elif get_image_worker().is_pending(image_path):
+                            st.info("Rasm tayyorlanmoqda...")
+                        elif get_image_worker().failure(image_path) is not None:
+                            st.error(f"Rasmni qayta ishlab bo'lmadi: {get_image_worker().failure(image_path)}. Rasmni qayta yuklang.")
                         else:
                             st.warning("Rasm topilmadi")
                     except Exception as e:
@@ -277,8 +1120,12 @@ def main():
                 st.subheader("Ranglar va o'lchamlar")
                 
                 # Group by rang and olcham
-                colors_df = product_details[['rang', 'olcham', 'miqdor', 'narx']].copy()
-                colors_df = colors_df.sort_values(['rang', 'olcham'])
+                # Barcha do'konlar ko'rinishida bir xil mahsulot bir necha do'konda bo'lishi mumkin
+                detail_columns = ['rang', 'olcham', 'miqdor', 'narx']
+                if view_file == ALL_STORES:
+                    detail_columns = ['dokon_id'] + detail_columns
+                colors_df = product_details[detail_columns].copy()
+                colors_df = colors_df.sort_values(detail_columns[:-2])
                 
                 # Show the table
                 st.dataframe(colors_df)
@@ -290,11 +1137,24 @@ def main():
         if inventory_data.empty:
             st.warning("Hozircha ma'lumotlar mavjud emas")
         else:
-            # Mahsulot tanlash
-            selected_product_id = st.selectbox("Tahrirlash uchun mahsulot tanlang", options=inventory_data['mahsulot_id'].unique())
+            # Mahsulot tanlash (indeks orqali, to'liq ustunni ko'rib chiqmasdan)
+            product_index = get_product_index(inventory_data, store_file)
+            selected_product_id = st.selectbox("Tahrirlash uchun mahsulot tanlang", options=product_index.product_ids)
+            
+            if selected_product_id:
+                # Optimistik tekshiruv: saqlashda oldingi chizishdagi versiya bilan solishtiriladi.
+                # Versiya jadvaldan oldin o'qiladi: oraliqdagi yozuv formada ko'rinmasa, saqlash ziddiyat beradi
+                edit_versions = st.session_state.setdefault('edit_versions', {})
+                expected_version = edit_versions.get(selected_product_id)
+                edit_versions[selected_product_id] = product_version(selected_product_id, store_file)
+                inventory_data = load_data(store_file)
+                product_index = get_product_index(inventory_data, store_file)
+                if not len(product_index.positions(selected_product_id)):
+                    st.warning("Mahsulot boshqa sessiyada o'chirildi")
+                    selected_product_id = None
             
             if selected_product_id:
-                product_data = inventory_data[inventory_data['mahsulot_id'] == selected_product_id]
+                product_data = inventory_data.iloc[product_index.positions(selected_product_id)]
                 
                 col1, col2 = st.columns(2)
                 
@@ -303,25 +1163,30 @@ def main():
                     st.subheader("Asosiy ma'lumotlar")
                     
                     # Mavjud ma'lumotlarni olish
-                    current_name = product_data['mahsulot_nomi'].iloc[0]
+                    # Bo'sh maydonlar (import yoki CSV dagi NULL/NaN) '' bo'lib ko'rsatiladi, 'nan' matni emas
+                    current_name = blank_to_empty(product_data['mahsulot_nomi'].iloc[0])
                     current_toifa = product_data['toifa'].iloc[0]
-                    current_davlat = product_data['davlat'].iloc[0]
-                    current_dokon_id = product_data['dokon_id'].iloc[0]
-                    current_omborchi = product_data['omborchi'].iloc[0]
-                    current_image_path = product_data['rasm_joyi'].iloc[0]
+                    current_davlat = blank_to_empty(product_data['davlat'].iloc[0])
+                    current_dokon_id = blank_to_empty(product_data['dokon_id'].iloc[0])
+                    current_omborchi = blank_to_empty(product_data['omborchi'].iloc[0])
+                    current_image_path = blank_to_empty(product_data['rasm_joyi'].iloc[0])
                     
                     # Tahrirlash formasini ko'rsatish
                     new_name = st.text_input("Mahsulot nomi", value=current_name)
-                    new_toifa = st.selectbox("Toifa", ["Erkaklar", "Ayollar", "Bolalar", "Qizlar"], index=["Erkaklar", "Ayollar", "Bolalar", "Qizlar"].index(current_toifa))
+                    new_toifa = st.selectbox("Toifa", TOIFA_OPTIONS, index=TOIFA_OPTIONS.index(current_toifa))
                     new_davlat = st.text_input("Ishlab chiqarilgan davlat", value=current_davlat)
                     new_dokon_id = st.text_input("Do'kon ID", value=current_dokon_id)
                     new_omborchi = st.text_input("Omborchi ismi", value=current_omborchi)
                     
                     # Rasmni ko'rsatish
                     try:
-                        if os.path.exists(current_image_path):
-                            image = Image.open(current_image_path)
+                        image = load_display_image(current_image_path)
+                        if image is not None:
                             st.image(image, caption='Joriy rasm', width=300)
+                        elif get_image_worker().is_pending(current_image_path):
+                            st.info("Rasm tayyorlanmoqda...")
+                        elif get_image_worker().failure(current_image_path) is not None:
+                            st.error(f"Rasmni qayta ishlab bo'lmadi: {get_image_worker().failure(current_image_path)}. Rasmni qayta yuklang.")
                         else:
                             st.warning("Rasm topilmadi")
                     except Exception as e:
@@ -356,42 +1221,38 @@ def main():
                         
                         # Tahrirlash formasi
                         new_rang = st.text_input("Rang", value=selected_row['rang'])
-                        new_olcham = st.selectbox("O'lcham", ["XS", "S", "M", "L", "XL", "XXL", "XXXL"], index=["XS", "S", "M", "L", "XL", "XXL", "XXXL"].index(selected_row['olcham']) if selected_row['olcham'] in ["XS", "S", "M", "L", "XL", "XXL", "XXXL"] else 0)
+                        new_olcham = st.selectbox("O'lcham", OLCHAM_OPTIONS, index=OLCHAM_OPTIONS.index(selected_row['olcham']) if selected_row['olcham'] in OLCHAM_OPTIONS else 0)
                         new_miqdor = st.number_input("Miqdor", min_value=0, step=1, value=int(selected_row['miqdor']))
                         new_narx = st.number_input("Narx", min_value=0, step=1000, value=int(selected_row['narx']))
                         
                         # Saqlash tugmasi
                         if st.button("Rang/o'lcham o'zgarishlarini saqlash"):
-                            # Filter the rows that need to be updated
-                            mask = (
-                                (inventory_data['mahsulot_id'] == selected_product_id) & 
-                                (inventory_data['rang'] == selected_row['rang']) & 
-                                (inventory_data['olcham'] == selected_row['olcham'])
-                            )
-                            
-                            # Update the values
-                            inventory_data.loc[mask, 'rang'] = new_rang
-                            inventory_data.loc[mask, 'olcham'] = new_olcham
-                            inventory_data.loc[mask, 'miqdor'] = new_miqdor
-                            inventory_data.loc[mask, 'narx'] = new_narx
-                            
-                            # Save the updated data
-                            save_data(inventory_data)
-                            st.success("Ranglar va o'lchamlar muvaffaqiyatli yangilandi!")
-                            st.experimental_rerun()
+                            # Faqat tanlangan variant qatori yangilanadi
+                            try:
+                                update_variant(selected_product_id, selected_row['rang'], selected_row['olcham'], {
+                                    'rang': new_rang,
+                                    'olcham': new_olcham,
+                                    'miqdor': new_miqdor,
+                                    'narx': new_narx
+                                }, store_file, expected_version=expected_version)
+                            except ConflictError as e:
+                                st.error(f"{e}. Yangilangan ma'lumotlarni ko'rib, o'zgarishni qayta kiriting.")
+                            else:
+                                st.success("Ranglar va o'lchamlar muvaffaqiyatli yangilandi!")
+                                st.rerun()
                     
                     # Yangi rang/o'lcham qo'shish
                     st.subheader("Yangi rang/o'lcham qo'shish")
                     
                     # Ranglar ro'yxati
-                    available_colors = ["Qora", "Oq", "Ko'k", "Qizil", "Yashil", "Sariq", "Jigarrang", "Kulrang"]
+                    available_colors = list(RANG_OPTIONS)
                     unique_colors = product_data['rang'].unique()
                     for color in unique_colors:
                         if color not in available_colors:
                             available_colors.append(color)
                     
                     add_color = st.selectbox("Rang", available_colors)
-                    add_olcham = st.selectbox("O'lcham", ["XS", "S", "M", "L", "XL", "XXL", "XXXL"])
+                    add_olcham = st.selectbox("O'lcham", OLCHAM_OPTIONS)
                     add_miqdor = st.number_input("Miqdor", min_value=0, step=1, key="add_miqdor")
                     add_narx = st.number_input("Narx", min_value=0, step=1000, key="add_narx")
                     
@@ -411,47 +1272,195 @@ def main():
                             'narx': add_narx
                         }
                         
-                        # Inventar ma'lumotlariga qo'shish
-                        inventory_data = pd.concat([inventory_data, pd.DataFrame([new_row])], ignore_index=True)
-                        save_data(inventory_data)
+                        # Inventar ma'lumotlariga qo'shish (faqat yangi qator yoziladi)
+                        append_data(pd.DataFrame([new_row]), store_file)
                         st.success("Yangi rang/o'lcham qo'shildi!")
-                        st.experimental_rerun()
+                        st.rerun()
                 
                 # Barcha o'zgarishlarni saqlash
                 if st.button("Asosiy ma'lumotlarni saqlash"):
                     # Rasmni yangilash
                     if new_image is not None:
-                        image = Image.open(new_image)
-                        new_image_path = save_image(image, selected_product_id)
+                        new_image_path = save_image_async(new_image)
                     else:
                         new_image_path = current_image_path
                     
-                    # Filter the rows that need to be updated
-                    mask = (inventory_data['mahsulot_id'] == selected_product_id)
-                    
-                    # Update the values
-                    inventory_data.loc[mask, 'mahsulot_nomi'] = new_name
-                    inventory_data.loc[mask, 'toifa'] = new_toifa
-                    inventory_data.loc[mask, 'davlat'] = new_davlat
-                    inventory_data.loc[mask, 'dokon_id'] = new_dokon_id
-                    inventory_data.loc[mask, 'omborchi'] = new_omborchi
-                    inventory_data.loc[mask, 'rasm_joyi'] = new_image_path
-                    
-                    # Save the updated data
-                    save_data(inventory_data)
-                    st.success("Mahsulot ma'lumotlari muvaffaqiyatli yangilandi!")
-                    
-                    # Update session state
-                    st.session_state['davlat'] = new_davlat
-                    st.session_state['dokon_id'] = new_dokon_id
-                    st.session_state['omborchi'] = new_omborchi
-                    
-                    # Refresh page
-                    st.experimental_rerun()
+                    # Faqat shu mahsulot variantlari yangilanadi; do'kon o'zgarsa, mahsulot o'sha do'kon fayliga ko'chadi
+                    values = {
+                        'mahsulot_nomi': new_name,
+                        'toifa': new_toifa,
+                        'davlat': new_davlat,
+                        'dokon_id': new_dokon_id,
+                        'omborchi': new_omborchi,
+                        'rasm_joyi': new_image_path
+                    }
+                    try:
+                        if store_filename(new_dokon_id) != store_file:
+                            move_product(selected_product_id, values, store_file, expected_version=expected_version)
+                        else:
+                            update_product(selected_product_id, values, store_file, expected_version=expected_version)
+                    except ConflictError as e:
+                        st.error(f"{e}. Yangilangan ma'lumotlarni ko'rib, o'zgarishni qayta kiriting.")
+                    else:
+                        st.success("Mahsulot ma'lumotlari muvaffaqiyatli yangilandi!")
+                        
+                        # Update session state
+                        st.session_state['davlat'] = new_davlat
+                        st.session_state['dokon_id_keyingi'] = new_dokon_id
+                        st.session_state['omborchi'] = new_omborchi
+                        
+                        # Refresh page
+                        st.rerun()
+    
+    # Hisobot (yig'ma jadvallardan, har bir rerunda groupby qilinmaydi)
+    elif action == "Hisobot":
+        st.header("Hisobot: barcha do'konlar" if view_file == ALL_STORES else f"Hisobot: {st.session_state.get('dokon_id', '')}")
+        
+        rollups = get_rollups(view_file)
+        if rollups.empty:
+            st.warning("Hozircha ma'lumotlar mavjud emas")
+        else:
+            totals = rollup_table(rollups, ROLLUP_COLUMNS[0])[['miqdor', 'summa', 'qatorlar']].sum()
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Jami miqdor", f"{int(totals['miqdor']):,}")
+            col2.metric("Jami qiymat (so'm)", f"{int(totals['summa']):,}")
+            col3.metric("Variantlar", f"{int(totals['qatorlar']):,}")
+            
+            labels = {'toifa': "Toifa", 'rang': "Rang", 'olcham': "O'lcham", 'dokon_id': "Do'kon", 'omborchi': "Omborchi"}
+            for tab, column in zip(st.tabs([labels[column] for column in ROLLUP_COLUMNS]), ROLLUP_COLUMNS):
+                with tab:
+                    table = rollup_table(rollups, column)
+                    st.dataframe(table, hide_index=True)
+                    st.bar_chart(table.set_index('qiymat')['summa'])
+    
+    # Ommaviy import
+    elif action == "Ommaviy import":
+        st.header("Ommaviy import (CSV/Excel)")
+        st.write(f"Majburiy ustunlar: {', '.join(IMPORT_REQUIRED_COLUMNS)}")
+        
+        import_file = st.file_uploader("Import faylini yuklang", type=["csv", "xlsx"])
+        if import_file is not None and st.button("Import qilish"):
+            try:
+                with st.spinner("Import qilinmoqda..."):
+                    report = import_inventory(import_file)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.success(f"{report['jami']} ta qatordan {report['yuklandi']} tasi yuklandi")
+                if report['xato_qatorlar']:
+                    st.warning(f"{report['xato_qatorlar']} ta qatorda xato bor")
+                    st.dataframe(pd.DataFrame(report['xatolar']))
     
     # Footer
     st.markdown("---")
     st.markdown("© 2025 Omborxona Boshqarish Tizimi")
 
+# Samaradorlik paneli: joriy rerun o'lchovlari va jarayon davomidagi gistogrammalar
+def show_performance_panel(spans):
+    history = st.session_state.setdefault('rerun_history', [])
+    total = next((span['soniya'] for span in spans if span['nom'] == 'main'), 0.0)
+    history.append(round(total * 1000, 1))
+    del history[:-20]
+    
+    with st.sidebar.expander("Samaradorlik", expanded=True):
+        st.caption("Joriy rerun")
+        rerun_df = pd.DataFrame(spans).reindex(columns=['nom', 'soniya', 'qatorlar'])
+        rerun_df['ms'] = (rerun_df.pop('soniya') * 1000).round(1)
+        rerun_df['qatorlar'] = rerun_df['qatorlar'].astype('Int64')
+        st.dataframe(rerun_df, hide_index=True)
+        st.caption("Oxirgi rerunlar (ms)")
+        st.line_chart(history)
+        
+        metrics = get_metrics()
+        st.caption("Jarayon boshidan beri")
+        st.dataframe(metrics.summary().round(1), hide_index=True)
+        st.caption(f"Rasm navbati: {get_image_worker().stats()}")
+        st.download_button("Prometheus", metrics.prometheus(), file_name="ombor_metrics.prom", mime="text/plain")
+        st.download_button("JSON", metrics.json_lines(), file_name="ombor_metrics.jsonl", mime="application/json")
+
+# Asosiy dastur: sahifa va uning vaqt o'lchovlari
+def main():
+    metrics = get_metrics()
+    with metrics.collect() as spans:
+        with metrics.span("main"):
+            render_page()
+        if st.sidebar.checkbox("Samaradorlik paneli"):
+            show_performance_panel(spans)
+        log_spans(list(spans))
+
+# Buyruq satri: python app.py <buyruq>
+def run_command(argv):
+    parser = argparse.ArgumentParser(prog="app.py", description="Omborxona boshqarish buyruqlari")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser("migrate", help="CSV fayldan SQLite bazaga ko'chirish")
+    migrate_parser.add_argument("--csv", default=DATA_FILE)
+    migrate_parser.add_argument("--db", default=DB_FILE)
+
+    compact_parser = commands.add_parser("compact", help="Jurnal/WAL fayllarini asosiy faylga birlashtirish")
+    compact_parser.add_argument("--file", default=None)
+
+    gc_parser = commands.add_parser("gc", help="Hech bir mahsulot ishlatmaydigan rasmlarni o'chirish")
+    gc_parser.add_argument("--dry-run", action="store_true", help="Faqat ko'rsatish, o'chirmaslik")
+    gc_parser.add_argument("--grace", type=int, default=IMAGE_GC_GRACE_SECONDS, help="Shu soniyadan yangi fayllarga tegmaslik")
+
+    commands.add_parser("migrate-images", help="Eski rasmlarni mazmun (sha256) bo'yicha nomlarga ko'chirish")
+
+    commands.add_parser("shard", help="Asosiy fayldagi qatorlarni do'kon (dokon_id) fayllariga ajratish")
+
+    import_parser = commands.add_parser("import", help="CSV/XLSX fayldan ommaviy import")
+    import_parser.add_argument("source")
+    import_parser.add_argument("--file", default=None)
+    import_parser.add_argument("--chunksize", type=int, default=IMPORT_CHUNK_ROWS)
+    import_parser.add_argument("--errors", default=None, help="Xatolarni CSV faylga yozish")
+
+    metrics_parser = commands.add_parser("metrics", help="OMBOR_METRICS_LOG faylidagi o'lchovlarni gistogramma sifatida chiqarish")
+    metrics_parser.add_argument("--log", default=METRICS_LOG or "data/metrics.jsonl")
+    metrics_parser.add_argument("--format", choices=["prometheus", "json", "table"], default="table")
+
+    args = parser.parse_args(argv)
+    create_folders()
+
+    if args.command == "migrate":
+        migrated = migrate_csv_to_sqlite(args.csv, SqliteStorage(args.db))
+        print(f"{migrated} ta qator ko'chirildi")
+    elif args.command == "compact":
+        get_storage(args.file).compact()
+        print("Birlashtirildi")
+    elif args.command == "gc":
+        result = collect_garbage_images(args.dry_run, args.grace)
+        action = "o'chiriladi" if args.dry_run else "o'chirildi"
+        print(f"{result['fayllar']} ta fayl {action} ({result['baytlar'] / 1024 / 1024:.1f} MB)")
+    elif args.command == "migrate-images":
+        migrated = migrate_images()
+        print(f"{migrated} ta rasm ko'chirildi; eski fayllarni o'chirish uchun: python app.py gc")
+    elif args.command == "shard":
+        moved = shard_by_store()
+        print(f"{moved} ta qator do'kon fayllariga ko'chirildi: {', '.join(list_stores())}")
+    elif args.command == "import":
+        try:
+            report = import_inventory(args.source, args.file, args.chunksize)
+        except ValueError as e:
+            sys.exit(str(e))
+        print(f"{report['jami']} ta qatordan {report['yuklandi']} tasi yuklandi, {report['xato_qatorlar']} ta qatorda xato")
+        if args.errors:
+            pd.DataFrame(report['xatolar'], columns=['qator', 'xato']).to_csv(args.errors, index=False)
+        else:
+            for error in report['xatolar'][:20]:
+                print(f"  {error['qator']}-qator: {error['xato']}")
+    elif args.command == "metrics":
+        if not os.path.exists(args.log):
+            sys.exit(f"Fayl topilmadi: {args.log}")
+        metrics = metrics_from_log(args.log)
+        if args.format == "prometheus":
+            print(metrics.prometheus(), end="")
+        elif args.format == "json":
+            print(metrics.json_lines(), end="")
+        else:
+            print(metrics.summary().round(1).to_string(index=False))
+
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1:
+        run_command(sys.argv[1:])
+    else:
+        main()
@@ -0,0 +1,313 @@
+# Sinov va benchmark vositalari: ishlab chiqarish ilovasidan (app.py) alohida
+# Ishga tushirish: python benchmarks.py <stress|bench|generate> ...
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+import app
+from app import (
+    OLCHAM_OPTIONS, RANG_OPTIONS, STORAGE_BACKEND, TOIFA_OPTIONS, FilterIndex,
+    append_data, get_data_cache, get_filter_index, get_page, get_product_index, get_storage,
+    load_data, save_data, save_image, take_rows, to_excel, update_product, update_variant
+)
+from storage import COLUMNS, ConflictError, empty_inventory
+
+# Bir vaqtda ko'p yozuvchi oqimlar bilan sinov: yozuvlar yo'qolmasligi kerak
+def stress_test_writes(filename, threads=8, writes=25, savers=2):
+    storage = get_storage(filename)
+    base = {
+        'mahsulot_id': 'STRESS',
+        'mahsulot_nomi': 'Stress',
+        'rasm_joyi': '',
+        'toifa': TOIFA_OPTIONS[0],
+        'davlat': '',
+        'dokon_id': '',
+        'omborchi': '',
+        'rang': 'Qora',
+        'olcham': 'M',
+        'miqdor': 0,
+        'narx': 0
+    }
+    append_data(pd.DataFrame([base]), filename)
+    conflicts = [0] * (threads + savers)
+    
+    def writer(n):
+        for i in range(writes):
+            # Har bir oqim o'z qatorlarini qo'shadi...
+            append_data(pd.DataFrame([dict(base, mahsulot_id=f"STRESS-{n}", rang=str(i))]), filename)
+            # ...va umumiy hisoblagichni versiya tekshiruvi bilan oshiradi
+            while True:
+                version = storage.product_version('STRESS')
+                df = storage.load()
+                current = df.loc[df['mahsulot_id'] == 'STRESS', 'miqdor'].iloc[0]
+                try:
+                    update_variant('STRESS', 'Qora', 'M', {'miqdor': int(current) + 1}, filename, expected_version=version)
+                    break
+                except ConflictError:
+                    conflicts[n] += 1
+    
+    # To'liq saqlovchi oqim: butun jadvalni o'qib, qator qo'shib, save_data bilan qayta yozadi
+    def saver(n):
+        for i in range(writes):
+            while True:
+                version = storage.version()
+                df = storage.load()
+                row = pd.DataFrame([dict(base, mahsulot_id=f"STRESS-S{n}", rang=str(i))])
+                try:
+                    save_data(pd.concat([df, row], ignore_index=True), filename, expected_version=version)
+                    break
+                except ConflictError:
+                    conflicts[threads + n] += 1
+    
+    with ThreadPoolExecutor(max_workers=threads + savers) as executor:
+        futures = [executor.submit(writer, n) for n in range(threads)]
+        futures += [executor.submit(saver, n) for n in range(savers)]
+        for future in futures:
+            future.result()
+    
+    df = storage.load()
+    return {
+        'qatorlar': len(df),
+        'kutilgan_qatorlar': (threads + savers) * writes + 1,
+        'hisoblagich': int(df.loc[df['mahsulot_id'] == 'STRESS', 'miqdor'].iloc[0]),
+        'kutilgan_hisoblagich': threads * writes,
+        'ziddiyatlar': sum(conflicts)
+    }
+
+# Benchmark natijalari saqlanadigan fayl (har bir ishga tushirish bitta JSON qator)
+BENCH_RESULTS_FILE = "data/benchmarks.jsonl"
+BENCH_REPEAT = 3
+# Sekinlashuv chegarasi: oxirgi ishga tushirishlar medianasidan nisbatan va mutlaq farq
+BENCH_REGRESSION_RATIO = 1.5
+BENCH_NOISE_SECONDS = 0.005
+BENCH_HISTORY_RUNS = 5
+
+# Sintetik inventar: har bir mahsulotda bir necha rang x o'lcham varianti
+# Do'konlar Zipf taqsimotida: birinchi do'konlarda mahsulotlar ko'proq
+def generate_inventory(rows, seed=0, image_paths=None):
+    if rows <= 0:
+        return empty_inventory()
+    rng = np.random.default_rng(seed)
+    colors_per_product = rng.integers(1, 5, size=rows)
+    sizes_per_product = rng.integers(2, 6, size=rows)
+    # Mahsulotlar soni qatorlar soniga yetguncha olinadi
+    variants = colors_per_product * sizes_per_product
+    products = int(np.searchsorted(np.cumsum(variants), rows)) + 1
+    variants = variants[:products]
+    variants[-1] -= variants.sum() - rows
+    
+    product = np.repeat(np.arange(products), variants)
+    within = np.arange(rows) - np.repeat(np.cumsum(variants) - variants, variants)
+    sizes = np.repeat(sizes_per_product[:products], variants)
+    color_offset = np.repeat(rng.integers(0, len(RANG_OPTIONS), size=products), variants)
+    size_offset = np.repeat(rng.integers(0, len(OLCHAM_OPTIONS), size=products), variants)
+    
+    product_ids = np.array([f"P{i:07d}" for i in range(products)], dtype=object)
+    stores = np.array([f"D{i:03d}" for i in range(max(1, products // 500))], dtype=object)
+    store_weights = 1.0 / np.arange(1, len(stores) + 1)
+    keepers = np.array(["Ali", "Vali", "Nodira", "Sardor", "Malika"], dtype=object)
+    countries = np.array(["O'zbekiston", "Turkiya", "Xitoy", "Rossiya", "Qozog'iston"], dtype=object)
+    if image_paths:
+        images = np.array(image_paths, dtype=object)[np.arange(products) % len(image_paths)]
+    else:
+        images = np.full(products, "", dtype=object)
+    
+    return pd.DataFrame({
+        'mahsulot_id': product_ids[product],
+        'mahsulot_nomi': np.array([f"Mahsulot {i}" for i in range(products)], dtype=object)[product],
+        'rasm_joyi': images[product],
+        'toifa': np.array(TOIFA_OPTIONS, dtype=object)[rng.integers(0, len(TOIFA_OPTIONS), size=products)][product],
+        'davlat': countries[rng.integers(0, len(countries), size=products)][product],
+        'dokon_id': stores[rng.choice(len(stores), size=products, p=store_weights / store_weights.sum())][product],
+        'omborchi': keepers[rng.integers(0, len(keepers), size=products)][product],
+        'rang': np.array(RANG_OPTIONS, dtype=object)[(color_offset + within // sizes) % len(RANG_OPTIONS)],
+        'olcham': np.array(OLCHAM_OPTIONS, dtype=object)[(size_offset + within % sizes) % len(OLCHAM_OPTIONS)],
+        'miqdor': pd.array(rng.integers(0, 200, size=rows), dtype='Int64'),
+        'narx': pd.array(rng.integers(10, 2000, size=rows) * 1000, dtype='Int64'),
+    }, columns=COLUMNS)
+
+# Sintetik rasmlar (rang o'tishli JPEG) va ularning kichik nusxalari
+def generate_images(count, size=(1600, 1200)):
+    gradient = np.linspace(0, 255, size[0], dtype=np.uint8)
+    paths = []
+    for i in range(count):
+        pixels = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        pixels[..., 0] = gradient
+        pixels[..., 1] = gradient[::-1] + i // 256
+        pixels[..., 2] = (i * 37) % 256
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, "PNG")
+        paths.append(save_image(buffer.getvalue()))
+    return paths
+
+# Funksiyani bir necha marta o'lchash: eng yaxshi natija (soniya) qaytariladi
+def _measure(func, repeat=BENCH_REPEAT, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+# Rasm papkalarini vaqtincha boshqa joyga yo'naltirish: benchmark rasmlari haqiqiy images/ ga tushmaydi
+@contextmanager
+def image_folders(folder):
+    saved = app.IMAGE_DIR, app.THUMBNAIL_DIR
+    app.IMAGE_DIR = os.path.join(folder, "images")
+    app.THUMBNAIL_DIR = os.path.join(app.IMAGE_DIR, "thumbs")
+    os.makedirs(app.IMAGE_DIR, exist_ok=True)
+    try:
+        yield
+    finally:
+        app.IMAGE_DIR, app.THUMBNAIL_DIR = saved
+
+# Asosiy ma'lumot yo'llari bo'yicha benchmark (vaqtinchalik omborda; rasmlar ham shu fayl papkasida)
+def run_benchmarks(rows, filename, repeat=BENCH_REPEAT, images=0, excel=True):
+    storage = get_storage(filename)
+    cache = get_data_cache()
+    image_paths = None
+    if images:
+        with image_folders(os.path.dirname(filename) or "."):
+            image_paths = generate_images(images)
+    data = generate_inventory(rows, image_paths=image_paths)
+    results = {}
+    
+    results['bulk_append'] = _measure(lambda: append_data(data, filename), repeat=1)
+    results['load_cold'] = _measure(lambda: load_data(filename), repeat, setup=lambda: cache.invalidate(storage))
+    results['load_cached'] = _measure(lambda: load_data(filename), repeat)
+    
+    df = load_data(filename)
+    filters = {'toifa': [TOIFA_OPTIONS[0]], 'rang': RANG_OPTIONS[:2], 'olcham': []}
+    results['filter_index_build'] = _measure(lambda: FilterIndex(df), repeat)
+    filter_index = get_filter_index(df, filename)
+    results['filter'] = _measure(lambda: take_rows(df, filter_index.select(filters)), repeat)
+    results['page_sorted'] = _measure(lambda: get_page(df, filter_index.select(filters), 1, 100, 'narx', filename=filename), repeat)
+    
+    # Bo'sh inventarda qidiriladigan yoki tahrirlanadigan qator yo'q
+    if not df.empty:
+        product_index = get_product_index(df, filename)
+        product_id = df['mahsulot_id'].iloc[len(df) // 2]
+        results['product_lookup'] = _measure(lambda: df.iloc[product_index.positions(product_id)], repeat)
+        
+        counter = iter(range(repeat))
+        new_product = data.iloc[:4]
+        results['add_product'] = _measure(
+            lambda: append_data(new_product.assign(mahsulot_id=f"BENCH-NEW-{next(counter)}"), filename), repeat
+        )
+        
+        variant = df.iloc[len(df) // 2]
+        key = (variant['mahsulot_id'], variant['rang'], variant['olcham'])
+        results['edit_variant'] = _measure(lambda: update_variant(*key, {'miqdor': int(time.time()) % 1000}, filename), repeat)
+        results['edit_product'] = _measure(lambda: update_product(key[0], {'omborchi': 'Benchmark'}, filename), repeat)
+    
+    if excel:
+        df = load_data(filename)
+        export_path = filename + ".xlsx"
+        results['excel_export'] = _measure(lambda: to_excel(df, export_path), repeat=1)
+        os.remove(export_path)
+    return results
+
+# Natijani tarixga yozish va oxirgi ishga tushirishlar medianasi bilan solishtirish
+def record_benchmarks(results, rows, backend, label="", results_file=BENCH_RESULTS_FILE, ratio=BENCH_REGRESSION_RATIO):
+    history = []
+    if os.path.exists(results_file):
+        with open(results_file) as f:
+            history = [json.loads(line) for line in f if line.strip()]
+    runs = [run['natijalar'] for run in history if run['qatorlar'] == rows and run['ombor'] == backend]
+    baseline = {}
+    for name in results:
+        previous = [run[name] for run in runs[-BENCH_HISTORY_RUNS:] if name in run]
+        if previous:
+            baseline[name] = float(np.median(previous))
+    regressions = {
+        name: (seconds, baseline[name])
+        for name, seconds in results.items()
+        if name in baseline and seconds > baseline[name] * ratio and seconds - baseline[name] > BENCH_NOISE_SECONDS
+    }
+    
+    folder = os.path.dirname(results_file)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(results_file, "a") as f:
+        f.write(json.dumps({
+            'vaqt': datetime.now().isoformat(timespec='seconds'),
+            'belgi': label,
+            'qatorlar': rows,
+            'ombor': backend,
+            'natijalar': results
+        }) + "\n")
+    return baseline, regressions
+
+# Buyruq satri: python benchmarks.py <buyruq>
+def main(argv):
+    parser = argparse.ArgumentParser(prog="benchmarks.py", description="Omborxona sinov va benchmark buyruqlari")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stress_parser = commands.add_parser("stress", help="Bir vaqtdagi yozuvchilar bilan sinov (vaqtinchalik faylda)")
+    stress_parser.add_argument("--backend", choices=["sqlite", "csv"], default=STORAGE_BACKEND)
+    stress_parser.add_argument("--threads", type=int, default=8)
+    stress_parser.add_argument("--writes", type=int, default=25)
+    stress_parser.add_argument("--savers", type=int, default=2, help="save_data bilan butun jadvalni qayta yozuvchi oqimlar")
+
+    bench_parser = commands.add_parser("bench", help="Ma'lumot yo'llari benchmarki (sintetik inventar, vaqtinchalik faylda)")
+    bench_parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    bench_parser.add_argument("--backend", choices=["sqlite", "csv"], default=STORAGE_BACKEND)
+    bench_parser.add_argument("--repeat", type=int, default=BENCH_REPEAT)
+    bench_parser.add_argument("--images", type=int, default=0, help="Yaratiladigan sintetik rasmlar soni")
+    bench_parser.add_argument("--no-excel", action="store_true", help="Excel eksportini o'lchamaslik")
+    bench_parser.add_argument("--label", default="", help="Natija belgisi (masalan, commit)")
+    bench_parser.add_argument("--results", default=BENCH_RESULTS_FILE)
+    bench_parser.add_argument("--check", action="store_true", help="Sekinlashuv bo'lsa xato bilan chiqish")
+
+    generate_parser = commands.add_parser("generate", help="Sintetik inventarni CSV faylga yozish (rasmlar images/ papkasiga)")
+    generate_parser.add_argument("output")
+    generate_parser.add_argument("--rows", type=int, default=10000)
+    generate_parser.add_argument("--images", type=int, default=0)
+    generate_parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "stress":
+        with tempfile.TemporaryDirectory() as folder:
+            extension = ".db" if args.backend == "sqlite" else ".csv"
+            result = stress_test_writes(os.path.join(folder, "stress" + extension), args.threads, args.writes, args.savers)
+        for key, value in result.items():
+            print(f"{key}: {value}")
+        if result['qatorlar'] != result['kutilgan_qatorlar'] or result['hisoblagich'] != result['kutilgan_hisoblagich']:
+            sys.exit("Yozuvlar yo'qoldi!")
+    elif args.command == "bench":
+        regressed = False
+        for rows in args.rows:
+            with tempfile.TemporaryDirectory() as folder:
+                extension = ".db" if args.backend == "sqlite" else ".csv"
+                results = run_benchmarks(rows, os.path.join(folder, "bench" + extension), args.repeat, args.images, not args.no_excel)
+            baseline, regressions = record_benchmarks(results, rows, args.backend, args.label, args.results)
+            print(f"{rows} qator ({args.backend}):")
+            for name, seconds in results.items():
+                previous = f" (oldingi: {baseline[name] * 1000:.1f} ms)" if name in baseline else ""
+                marker = "  SEKINLASHDI" if name in regressions else ""
+                print(f"  {name:<20} {seconds * 1000:10.1f} ms{previous}{marker}")
+            regressed = regressed or bool(regressions)
+        if args.check and regressed:
+            sys.exit("Benchmark natijalari sekinlashdi")
+    elif args.command == "generate":
+        app.create_folders()
+        image_paths = generate_images(args.images) if args.images else None
+        generate_inventory(args.rows, args.seed, image_paths).to_csv(args.output, index=False)
+        print(f"{args.rows} ta qator yozildi: {args.output}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
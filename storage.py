@@ -0,0 +1,834 @@
+# Ombor (CSV/SQLite), umumiy ma'lumotlar keshi va vaqt o'lchovlari.
+# Streamlit app.py ni har bir rerunda qaytadan bajaradi, bu modul esa jarayonda bir marta import
+# qilinadi: keshdagi (cache_resource) obyektlar va ConflictError sinfi rerunlar orasida bir xil qoladi.
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    # Windows'da fayl qulfi yo'q: jarayon ichidagi qulf bilan cheklanamiz
+    fcntl = None
+
+logger = logging.getLogger("ombor")
+
+# Barcha do'konlar ko'rinishi (bir nechta fayldan yig'ilgan jadval) kaliti
+ALL_STORES = "*"
+
+# Fayl yo'llari
+DATA_FILE = "data/inventory_data.csv"
+DB_FILE = "data/inventory.db"
+
+# CSV jurnali shu hajmdan oshganda asosiy faylga birlashtiriladi
+CSV_COMPACT_BYTES = 1024 * 1024
+
+# Inventar ustunlari
+COLUMNS = [
+    'mahsulot_id',
+    'mahsulot_nomi',
+    'rasm_joyi',
+    'toifa',
+    'davlat',
+    'dokon_id',
+    'omborchi',
+    'rang',
+    'olcham',
+    'miqdor',
+    'narx'
+]
+
+# Ustun turlari: CSV'ni turlarni taxmin qilmasdan tezroq o'qish uchun
+NUMERIC_DTYPES = {'miqdor': 'Int64', 'narx': 'Int64'}
+DTYPES = {column: str for column in COLUMNS if column not in NUMERIC_DTYPES}
+DTYPES.update(NUMERIC_DTYPES)
+
+# Har bir qatorni aniqlovchi kalit ustunlar
+KEY_COLUMNS = ['mahsulot_id', 'rang', 'olcham']
+KEY_POSITIONS = [COLUMNS.index(column) for column in KEY_COLUMNS]
+
+# Normallashtirilgan sxema: mahsulot (umumiy) va variant (rang/o'lcham) ustunlari
+PRODUCT_COLUMNS = ['mahsulot_id', 'mahsulot_nomi', 'rasm_joyi', 'toifa', 'davlat', 'dokon_id', 'omborchi']
+VARIANT_COLUMNS = ['mahsulot_id', 'rang', 'olcham', 'miqdor', 'narx']
+PRODUCT_POSITIONS = [COLUMNS.index(column) for column in PRODUCT_COLUMNS]
+VARIANT_POSITIONS = [COLUMNS.index(column) for column in VARIANT_COLUMNS]
+
+# Hisobot (yig'ma jadval) ustunlari: miqdor va qiymat (miqdor x narx) shular bo'yicha yig'iladi
+ROLLUP_COLUMNS = ['toifa', 'rang', 'olcham', 'dokon_id', 'omborchi']
+ROLLUP_PRODUCT_COLUMNS = [column for column in ROLLUP_COLUMNS if column in PRODUCT_COLUMNS]
+
+# Xotirada kategoriya sifatida saqlanadigan (takrorlanuvchi) ustunlar
+CATEGORY_COLUMNS = ['mahsulot_nomi', 'rasm_joyi', 'toifa', 'davlat', 'dokon_id', 'omborchi', 'rang', 'olcham']
+
+# Bo'sh inventar jadvali
+def empty_inventory():
+    return pd.DataFrame({column: [] for column in COLUMNS}).astype(DTYPES)
+
+# Takrorlanuvchi matnli ustunlarni kategoriyaga aylantirish (xotirani bir necha barobar kamaytiradi)
+def compact_dtypes(df):
+    return df.astype({column: 'category' for column in CATEGORY_COLUMNS if column in df.columns})
+
+# Fayl(lar)ning o'zgarganini bilish uchun imzo (mtime va hajm)
+def _file_signature(*filenames):
+    signature = []
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+# DataFrame qatorlarini SQLite uchun tuplelarga aylantirish
+def _to_records(df, columns=COLUMNS):
+    df = df.reindex(columns=columns).astype(object)
+    df[KEY_COLUMNS] = df[KEY_COLUMNS].fillna('').astype(str)
+    df = df.where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+# Eski fayllardagi takroriy (mahsulot_id, rang, olcham) qatorlarni birlashtirish:
+# SQLite ko'chirishdagidek miqdorlar qo'shiladi, qolgan ustunlar oxirgi qatordan olinadi
+def merge_duplicate_variants(df):
+    if not df.duplicated(KEY_COLUMNS).any():
+        return df
+    totals = df.groupby(KEY_COLUMNS, sort=False, dropna=False)['miqdor'].transform('sum')
+    return df.assign(miqdor=totals).drop_duplicates(KEY_COLUMNS, keep='last', ignore_index=True)
+
+class ConflictError(Exception):
+    """Yozuv eskirgan versiyaga asoslangan: ma'lumotlarni boshqa foydalanuvchi o'zgartirgan"""
+
+# Optimistik versiya tekshiruvi
+def check_version(current, expected):
+    if expected is not None and current != expected:
+        raise ConflictError(
+            f"Ma'lumotlar boshqa foydalanuvchi tomonidan o'zgartirilgan (kutilgan versiya {expected}, joriy {current})"
+        )
+
+# Yig'ma jadval: har bir ROLLUP_COLUMNS ustuni qiymati bo'yicha miqdor, qiymat va qatorlar soni
+def compute_rollups(df):
+    amounts = pd.DataFrame({
+        'miqdor': df['miqdor'].fillna(0).astype('int64'),
+        'summa': df['miqdor'].fillna(0).astype('int64') * df['narx'].fillna(0).astype('int64')
+    })
+    frames = []
+    for column in ROLLUP_COLUMNS:
+        grouped = amounts.groupby(df[column].astype(object).fillna('').to_numpy(), sort=False).agg(
+            miqdor=('miqdor', 'sum'), summa=('summa', 'sum'), qatorlar=('miqdor', 'size')
+        )
+        frames.append(grouped.rename_axis('qiymat').reset_index().assign(ustun=column))
+    return pd.concat(frames, ignore_index=True).reindex(columns=['ustun', 'qiymat', 'miqdor', 'summa', 'qatorlar'])
+
+class CsvStorage:
+    """Inventarni CSV faylda saqlaydigan ombor
+
+    Yangi qatorlar alohida jurnal fayliga qo'shib boriladi, jurnal kattalashganda
+    asosiy fayl bilan birlashtiriladi (compact). Barcha yozuvlar fayl qulfi ostida
+    bajariladi, asosiy fayl vaqtinchalik fayl + almashtirish orqali yoziladi.
+    """
+
+    def __init__(self, filename=DATA_FILE, compact_bytes=CSV_COMPACT_BYTES):
+        self.filename = filename
+        self.journal_filename = os.path.splitext(filename)[0] + ".journal.csv"
+        self.version_filename = os.path.splitext(filename)[0] + ".version"
+        self.lock_filename = filename + ".lock"
+        self.compact_bytes = compact_bytes
+        self.lock = threading.RLock()
+        self._lock_depth = 0
+
+    @contextmanager
+    def _locked(self):
+        # Jarayon ichida oqimlar, jarayonlar orasida esa fayl qulfi bitta yozuvchini ta'minlaydi
+        with self.lock:
+            if self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(self.lock_filename, "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth = 0
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def signature(self):
+        return _file_signature(self.filename, self.journal_filename)
+
+    def version(self):
+        try:
+            with open(self.version_filename) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    # CSV omborida alohida mahsulot versiyasi yo'q: umumiy versiya ishlatiladi
+    def product_version(self, product_id):
+        return self.version()
+
+    def _bump_version(self):
+        tmp_path = self.version_filename + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self.version() + 1))
+        os.replace(tmp_path, self.version_filename)
+
+    def _read(self, filename):
+        try:
+            return pd.read_csv(filename, dtype=DTYPES)
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        # Jurnal joyida to'ldiriladi: yarim yozilgan qatorni o'qimaslik uchun qulf ostida o'qiladi
+        with self._locked():
+            df = self._read(self.filename)
+            journal = self._read(self.journal_filename)
+        if df is None:
+            # Agar fayl topilmasa, yangi DataFrame yaratamiz
+            df = empty_inventory()
+        df = merge_duplicate_variants(df)
+        if journal is not None and not journal.empty:
+            # Jurnaldagi qatorlar faqat bir xil kalitli asosiy fayl qatorlarining o'rnini bosadi
+            journal = journal.drop_duplicates(KEY_COLUMNS, keep='last', ignore_index=True)
+            replaced = pd.MultiIndex.from_frame(df[KEY_COLUMNS]).isin(pd.MultiIndex.from_frame(journal[KEY_COLUMNS]))
+            df = pd.concat([df[~replaced], journal], ignore_index=True)
+        return df
+
+    def _save(self, df):
+        # Yozish o'rtasida uzilish bo'lsa ham asosiy fayl butun qoladi
+        tmp_path = self.filename + ".tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.filename)
+        if os.path.exists(self.journal_filename):
+            os.remove(self.journal_filename)
+
+    def save(self, df, expected_version=None):
+        with self._locked():
+            check_version(self.version(), expected_version)
+            self._save(df)
+            self._bump_version()
+
+    def append(self, df):
+        # Faqat yangi qatorlar yoziladi: vaqt va disk hajmi inventar hajmiga bog'liq emas
+        with self._locked():
+            header = not os.path.exists(self.journal_filename)
+            df.reindex(columns=COLUMNS).to_csv(self.journal_filename, mode='a', header=header, index=False)
+            self._bump_version()
+            if os.path.getsize(self.journal_filename) >= self.compact_bytes:
+                self._save(self.load())
+
+    def compact(self):
+        with self._locked():
+            self._save(self.load())
+
+    # CSV faylda qatorni joyida o'zgartirib bo'lmaydi: fayl to'liq qayta yoziladi
+    def _update(self, mask_for, values, expected_version):
+        with self._locked():
+            check_version(self.version(), expected_version)
+            df = self.load()
+            mask = mask_for(df)
+            if not mask.any():
+                raise ConflictError("Yangilanadigan qator topilmadi: u o'chirilgan yoki o'zgartirilgan")
+            for column, value in values.items():
+                df.loc[mask, column] = value
+            # Variant boshqa mavjud rang/o'lchamga o'zgartirilsa, u qator ustidan yozilmaydi
+            # (faqat tahrirlangan qatorlar tekshiriladi: fayldagi eski takrorlar boshqa tahrirlarga xalaqit bermaydi)
+            if not set(values).isdisjoint(KEY_COLUMNS):
+                edited = df.loc[mask, KEY_COLUMNS]
+                if not edited.merge(df.loc[~mask, KEY_COLUMNS]).empty:
+                    raise ConflictError("Bu rang/o'lcham allaqachon mavjud")
+            self._save(df)
+            self._bump_version()
+
+    def update_variant(self, key, values, expected_version=None):
+        self._update(
+            lambda df: (df['mahsulot_id'] == key[0]) & (df['rang'] == key[1]) & (df['olcham'] == key[2]),
+            values, expected_version
+        )
+
+    def update_product(self, product_id, values, expected_version=None):
+        self._update(lambda df: df['mahsulot_id'] == product_id, values, expected_version)
+
+    # CSV'da triggerlar yo'q: yig'ma jadval yuklangan jadvaldan hisoblanadi (har bir versiya uchun bir marta)
+    def rollups(self, df=None):
+        return compute_rollups(self.load() if df is None else df)
+
+    def rename_images(self, mapping):
+        with self._locked():
+            df = self.load()
+            df['rasm_joyi'] = df['rasm_joyi'].replace(mapping)
+            self._save(df)
+            self._bump_version()
+
+    def delete_product(self, product_id, expected_version=None):
+        with self._locked():
+            check_version(self.version(), expected_version)
+            df = self.load()
+            self._save(df[df['mahsulot_id'] != product_id])
+            self._bump_version()
+
+class SqliteStorage:
+    """SQLite (WAL rejimi) ombori: mahsulotlar va variantlar alohida jadvallarda
+
+    products jadvalida har bir mahsulotning umumiy ma'lumotlari bitta qatorda, variants
+    jadvalida esa (mahsulot_id, rang, olcham) kaliti bo'yicha miqdor va narx saqlanadi.
+    Ko'rsatish va eksport uchun inventory ko'rinishi (view) ularni birlashtiradi.
+
+    Har bir yozuv BEGIN IMMEDIATE tranzaksiyasida bajariladi va umumiy versiyani oshiradi;
+    har bir mahsulot versiyasi triggerlar orqali yuritiladi.
+    """
+
+    def __init__(self, filename=DB_FILE):
+        self.filename = filename
+        folder = os.path.dirname(filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._create_schema()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.filename, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # OR REPLACE o'chirgan qatorlar uchun ham DELETE triggerlari ishlashi kerak
+        conn.execute("PRAGMA recursive_triggers=ON")
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        # Yozish qulfi tranzaksiya boshida olinadi: versiya tekshiruvi va yozuv orasida boshqa yozuvchi bo'lmaydi
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def _create_schema(self):
+        conn = self._connect()
+        try:
+            # WAL rejimi bazada saqlanib qoladi: o'quvchilar yozuvchini kutmaydi
+            conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+        with self.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS products (
+                    mahsulot_id TEXT PRIMARY KEY,
+                    mahsulot_nomi TEXT,
+                    rasm_joyi TEXT,
+                    toifa TEXT,
+                    davlat TEXT,
+                    dokon_id TEXT,
+                    omborchi TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS variants (
+                    mahsulot_id TEXT NOT NULL,
+                    rang TEXT NOT NULL,
+                    olcham TEXT NOT NULL,
+                    miqdor INTEGER,
+                    narx INTEGER,
+                    PRIMARY KEY (mahsulot_id, rang, olcham)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_variants_mahsulot_id ON variants (mahsulot_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_variants_rang ON variants (rang)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_variants_olcham ON variants (olcham)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_products_toifa ON products (toifa)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (kalit TEXT PRIMARY KEY, qiymat TEXT)")
+            conn.execute("INSERT OR IGNORE INTO meta (kalit, qiymat) VALUES ('versiya', '0')")
+            
+            # Eski sxemadan (bitta inventory jadvali) ko'chirish: mahsulot uchun oxirgi qator ma'lumotlari olinadi
+            old_table = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'inventory'").fetchone()
+            if old_table:
+                product_columns = ", ".join(PRODUCT_COLUMNS)
+                variant_columns = ", ".join(VARIANT_COLUMNS)
+                conn.execute(f"INSERT OR REPLACE INTO products ({product_columns}) SELECT {product_columns} FROM inventory ORDER BY rowid")
+                conn.execute(f"INSERT OR REPLACE INTO variants ({variant_columns}) SELECT {variant_columns} FROM inventory ORDER BY rowid")
+                conn.execute("DROP TABLE inventory")
+            
+            conn.execute(f"""
+                CREATE VIEW IF NOT EXISTS inventory AS
+                SELECT {", ".join(("v." if column in VARIANT_COLUMNS else "p.") + column for column in COLUMNS)}
+                FROM variants v JOIN products p ON p.mahsulot_id = v.mahsulot_id
+                ORDER BY v.rowid
+            """)
+            
+            # Mahsulot versiyalari: mahsulot yoki uning variantlari har o'zgarganda oshadi
+            conn.execute("CREATE TABLE IF NOT EXISTS mahsulot_versiyalari (mahsulot_id TEXT PRIMARY KEY, versiya INTEGER NOT NULL)")
+            for table in ["products", "variants"]:
+                for event, row in [("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")]:
+                    conn.execute(f"""
+                        CREATE TRIGGER IF NOT EXISTS {table}_versiya_{event.lower()} AFTER {event} ON {table}
+                        BEGIN
+                            INSERT INTO mahsulot_versiyalari (mahsulot_id, versiya) VALUES ({row}.mahsulot_id, 1)
+                            ON CONFLICT(mahsulot_id) DO UPDATE SET versiya = versiya + 1;
+                        END
+                    """)
+            
+            # Yig'ma jadval: har bir o'zgarishda faqat tegishli qiymatlar yangilanadi (to'liq groupby yo'q)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS svodka (
+                    ustun TEXT NOT NULL,
+                    qiymat TEXT NOT NULL,
+                    miqdor INTEGER NOT NULL,
+                    summa INTEGER NOT NULL,
+                    qatorlar INTEGER NOT NULL,
+                    PRIMARY KEY (ustun, qiymat)
+                )
+            """)
+            for event, rows in [("INSERT", [("NEW", 1)]), ("UPDATE", [("OLD", -1), ("NEW", 1)]), ("DELETE", [("OLD", -1)])]:
+                statements = "".join(self._rollup_variant_sql(row, sign) for row, sign in rows)
+                conn.execute(f"CREATE TRIGGER IF NOT EXISTS variants_svodka_{event.lower()} AFTER {event} ON variants BEGIN {statements} END")
+            # Mahsulot toifasi/do'koni/omborchisi o'zgarsa, uning variantlari yig'indisi ko'chiriladi
+            statements = "".join(self._rollup_product_sql(row, sign) for row, sign in [("OLD", -1), ("NEW", 1)])
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS products_svodka_update AFTER UPDATE OF {", ".join(ROLLUP_PRODUCT_COLUMNS)} ON products
+                BEGIN {statements} END
+            """)
+            if not self.get_meta("svodka_qurildi", conn=conn):
+                self.rebuild_rollups(conn)
+                self.set_meta("svodka_qurildi", datetime.now().isoformat(), conn=conn)
+
+    _ROLLUP_UPSERT = """
+        ON CONFLICT(ustun, qiymat) DO UPDATE SET
+            miqdor = miqdor + excluded.miqdor,
+            summa = summa + excluded.summa,
+            qatorlar = qatorlar + excluded.qatorlar;
+    """
+
+    def _rollup_variant_sql(self, row, sign):
+        # Bitta variant qatori hissasi (sign = 1 qo'shish, -1 ayirish)
+        amount = f"{sign} * COALESCE({row}.miqdor, 0)"
+        total = f"{amount} * COALESCE({row}.narx, 0)"
+        sql = ""
+        for column in ROLLUP_COLUMNS:
+            if column in ROLLUP_PRODUCT_COLUMNS:
+                source = f"FROM products p WHERE p.mahsulot_id = {row}.mahsulot_id"
+                value = f"COALESCE(p.{column}, '')"
+            else:
+                source = "WHERE 1"
+                value = f"COALESCE({row}.{column}, '')"
+            sql += (
+                f"INSERT INTO svodka (ustun, qiymat, miqdor, summa, qatorlar) "
+                f"SELECT '{column}', {value}, {amount}, {total}, {sign} {source} {self._ROLLUP_UPSERT}"
+            )
+        return sql
+
+    def _rollup_product_sql(self, row, sign):
+        # Mahsulotning barcha variantlari hissasi (mahsulot ustunlari uchun)
+        sql = ""
+        for column in ROLLUP_PRODUCT_COLUMNS:
+            sql += (
+                f"INSERT INTO svodka (ustun, qiymat, miqdor, summa, qatorlar) "
+                f"SELECT '{column}', COALESCE({row}.{column}, ''), "
+                f"{sign} * SUM(COALESCE(miqdor, 0)), "
+                f"{sign} * SUM(COALESCE(miqdor, 0) * COALESCE(narx, 0)), "
+                f"{sign} * COUNT(*) "
+                f"FROM variants WHERE mahsulot_id = {row}.mahsulot_id GROUP BY mahsulot_id {self._ROLLUP_UPSERT}"
+            )
+        return sql
+
+    def rebuild_rollups(self, conn):
+        # Yig'ma jadvalni noldan hisoblash (sxema yaratilganda yoki tekshiruv uchun)
+        conn.execute("DELETE FROM svodka")
+        for column in ROLLUP_COLUMNS:
+            conn.execute(f"""
+                INSERT INTO svodka (ustun, qiymat, miqdor, summa, qatorlar)
+                SELECT '{column}', COALESCE({column}, ''), SUM(COALESCE(miqdor, 0)),
+                       SUM(COALESCE(miqdor, 0) * COALESCE(narx, 0)), COUNT(*)
+                FROM inventory GROUP BY COALESCE({column}, '')
+            """)
+
+    # df ishlatilmaydi: yig'ma jadvalni triggerlar yuritadi
+    def rollups(self, df=None):
+        conn = self._connect()
+        try:
+            return pd.read_sql_query(
+                "SELECT ustun, qiymat, miqdor, summa, qatorlar FROM svodka WHERE qatorlar > 0", conn
+            )
+        finally:
+            conn.close()
+
+    def get_meta(self, key, default=None, conn=None):
+        if conn is not None:
+            row = conn.execute("SELECT qiymat FROM meta WHERE kalit = ?", (key,)).fetchone()
+            return row[0] if row else default
+        conn = self._connect()
+        try:
+            return self.get_meta(key, default, conn)
+        finally:
+            conn.close()
+
+    def set_meta(self, key, value, conn=None):
+        sql = "INSERT INTO meta (kalit, qiymat) VALUES (?, ?) ON CONFLICT(kalit) DO UPDATE SET qiymat = excluded.qiymat"
+        if conn is not None:
+            conn.execute(sql, (key, str(value)))
+            return
+        with self.transaction() as conn:
+            conn.execute(sql, (key, str(value)))
+
+    def version(self, conn=None):
+        return int(self.get_meta("versiya", 0, conn))
+
+    def product_version(self, product_id, conn=None):
+        if conn is None:
+            conn = self._connect()
+            try:
+                return self.product_version(product_id, conn)
+            finally:
+                conn.close()
+        row = conn.execute("SELECT versiya FROM mahsulot_versiyalari WHERE mahsulot_id = ?", (product_id,)).fetchone()
+        return row[0] if row else 0
+
+    def _bump_version(self, conn):
+        conn.execute("UPDATE meta SET qiymat = CAST(qiymat AS INTEGER) + 1 WHERE kalit = 'versiya'")
+
+    def signature(self):
+        # WAL rejimida yozuvlar avval -wal fayliga tushadi
+        return _file_signature(self.filename, self.filename + "-wal")
+
+    def load(self):
+        columns = ", ".join(COLUMNS)
+        conn = self._connect()
+        try:
+            return pd.read_sql_query(f"SELECT {columns} FROM inventory", conn, dtype=NUMERIC_DTYPES)
+        finally:
+            conn.close()
+
+    def _upsert(self, conn, table, columns, key_columns, records):
+        # Kalit bo'yicha qo'shish/yangilash; o'zgarmagan qatorlarga tegilmaydi
+        value_columns = [c for c in columns if c not in key_columns]
+        updates = ", ".join(f"{c} = excluded.{c}" for c in value_columns)
+        changed = " OR ".join(f"{table}.{c} IS NOT excluded.{c}" for c in value_columns)
+        conn.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT({', '.join(key_columns)}) DO UPDATE SET {updates} WHERE {changed}",
+            records
+        )
+
+    def upsert_rows(self, conn, records):
+        # To'liq qatorlar mahsulot va variant qismlariga ajratiladi; mahsulot uchun oxirgi qator olinadi
+        products = {}
+        for record in records:
+            products[record[0]] = tuple(record[i] for i in PRODUCT_POSITIONS)
+        self._upsert(conn, "products", PRODUCT_COLUMNS, ['mahsulot_id'], list(products.values()))
+        self._upsert(conn, "variants", VARIANT_COLUMNS, KEY_COLUMNS, [tuple(r[i] for i in VARIANT_POSITIONS) for r in records])
+
+    def append(self, df):
+        with self.transaction() as conn:
+            self.upsert_rows(conn, _to_records(df))
+            self._bump_version(conn)
+
+    def compact(self):
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+
+    def _split_values(self, values):
+        unknown = set(values) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Noma'lum ustunlar: {sorted(unknown)}")
+        if 'mahsulot_id' in values:
+            raise ValueError("mahsulot_id ni o'zgartirib bo'lmaydi")
+        product_values = {c: v for c, v in values.items() if c in PRODUCT_COLUMNS}
+        variant_values = {c: v for c, v in values.items() if c in VARIANT_COLUMNS}
+        return product_values, variant_values
+
+    def _set_clause(self, values):
+        return ", ".join(f"{column} = ?" for column in values)
+
+    def update_variant(self, key, values, expected_version=None):
+        # Birlamchi kalit bo'yicha bitta qator; yangi kalit band bo'lsa, ConflictError (mavjud qator ustidan yozilmaydi)
+        product_values, variant_values = self._split_values(values)
+        with self.transaction() as conn:
+            check_version(self.product_version(key[0], conn), expected_version)
+            if variant_values:
+                try:
+                    cursor = conn.execute(
+                        f"UPDATE variants SET {self._set_clause(variant_values)} "
+                        "WHERE mahsulot_id = ? AND rang = ? AND olcham = ?",
+                        [*variant_values.values(), *key]
+                    )
+                except sqlite3.IntegrityError:
+                    raise ConflictError("Bu rang/o'lcham allaqachon mavjud")
+                if cursor.rowcount == 0:
+                    raise ConflictError("Yangilanadigan qator topilmadi: u o'chirilgan yoki o'zgartirilgan")
+            if product_values:
+                conn.execute(
+                    f"UPDATE products SET {self._set_clause(product_values)} WHERE mahsulot_id = ?",
+                    [*product_values.values(), key[0]]
+                )
+            self._bump_version(conn)
+
+    def update_product(self, product_id, values, expected_version=None):
+        # Umumiy ma'lumotlar products jadvalidagi bitta qatorga yoziladi
+        product_values, variant_values = self._split_values(values)
+        with self.transaction() as conn:
+            check_version(self.product_version(product_id, conn), expected_version)
+            if product_values:
+                cursor = conn.execute(
+                    f"UPDATE products SET {self._set_clause(product_values)} WHERE mahsulot_id = ?",
+                    [*product_values.values(), product_id]
+                )
+                if cursor.rowcount == 0:
+                    raise ConflictError("Yangilanadigan qator topilmadi: u o'chirilgan yoki o'zgartirilgan")
+            if variant_values:
+                conn.execute(
+                    f"UPDATE variants SET {self._set_clause(variant_values)} WHERE mahsulot_id = ?",
+                    [*variant_values.values(), product_id]
+                )
+            self._bump_version(conn)
+
+    def rename_images(self, mapping):
+        with self.transaction() as conn:
+            conn.executemany("UPDATE products SET rasm_joyi = ? WHERE rasm_joyi = ?", [(new, old) for old, new in mapping.items()])
+            self._bump_version(conn)
+
+    def delete_product(self, product_id, expected_version=None):
+        with self.transaction() as conn:
+            check_version(self.product_version(product_id, conn), expected_version)
+            conn.execute("DELETE FROM variants WHERE mahsulot_id = ?", (product_id,))
+            conn.execute("DELETE FROM products WHERE mahsulot_id = ?", (product_id,))
+            self._bump_version(conn)
+
+    def save(self, df, expected_version=None):
+        records = _to_records(df)
+        with self.transaction() as conn:
+            check_version(self.version(conn), expected_version)
+            self.upsert_rows(conn, records)
+            # DataFrame'da qolmagan kalitlarni o'chirish (masalan, rang/o'lcham o'zgartirilganda)
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS saqlangan_kalitlar (mahsulot_id TEXT, rang TEXT, olcham TEXT)")
+            conn.execute("DELETE FROM saqlangan_kalitlar")
+            conn.executemany(
+                "INSERT INTO saqlangan_kalitlar VALUES (?, ?, ?)",
+                [tuple(r[i] for i in KEY_POSITIONS) for r in records]
+            )
+            conn.execute("""
+                DELETE FROM variants
+                WHERE (mahsulot_id, rang, olcham) NOT IN (
+                    SELECT mahsulot_id, rang, olcham FROM saqlangan_kalitlar
+                )
+            """)
+            conn.execute("DELETE FROM products WHERE mahsulot_id NOT IN (SELECT mahsulot_id FROM variants)")
+            self._bump_version(conn)
+
+# CSV fayldan SQLite bazaga bir martalik ko'chirish
+def migrate_csv_to_sqlite(csv_filename=DATA_FILE, storage=None, chunksize=10000):
+    if storage is None:
+        storage = SqliteStorage(DB_FILE)
+    if not os.path.exists(csv_filename):
+        return 0
+    with storage.transaction() as conn:
+        # Tekshiruv tranzaksiya ichida: bir vaqtda ishga tushgan jarayonlar ikki marta ko'chirmaydi
+        if storage.get_meta("csv_migrated", conn=conn):
+            return 0
+        # Avval vaqtinchalik jadvalga: takroriy kalitlar bo'laklar orasida ham birlashtiriladi
+        conn.execute(f"CREATE TEMP TABLE csv_kochirish ({', '.join(COLUMNS)})")
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        total = 0
+        # Turlar berilmasa, mahsulot kodlari songa aylanadi ('00123' -> 123)
+        for chunk in pd.read_csv(csv_filename, chunksize=chunksize, dtype=DTYPES):
+            records = _to_records(chunk)
+            conn.executemany(f"INSERT INTO csv_kochirish VALUES ({placeholders})", records)
+            total += len(records)
+        
+        # Mahsulot ma'lumotlari oxirgi qatordan; bir xil variant qatorlari miqdori qo'shiladi, narx oxirgisidan
+        product_columns = ", ".join(PRODUCT_COLUMNS)
+        conn.execute(f"""
+            INSERT OR REPLACE INTO products ({product_columns})
+            SELECT {product_columns} FROM csv_kochirish
+            WHERE rowid IN (SELECT MAX(rowid) FROM csv_kochirish GROUP BY mahsulot_id)
+        """)
+        conn.execute("""
+            INSERT OR REPLACE INTO variants (mahsulot_id, rang, olcham, miqdor, narx)
+            SELECT k.mahsulot_id, k.rang, k.olcham, g.miqdor, k.narx
+            FROM csv_kochirish k
+            JOIN (
+                SELECT MAX(rowid) AS oxirgi, SUM(miqdor) AS miqdor FROM csv_kochirish
+                GROUP BY mahsulot_id, rang, olcham
+            ) g ON k.rowid = g.oxirgi
+        """)
+        migrated = conn.execute("SELECT changes()").fetchone()[0]
+        conn.execute("DROP TABLE csv_kochirish")
+        if total > migrated:
+            logger.warning("CSV ko'chirish: %d ta takroriy qator miqdori bir qatorga qo'shildi", total - migrated)
+        storage.set_meta("csv_migrated", datetime.now().isoformat(), conn=conn)
+        storage._bump_version(conn)
+    return migrated
+
+# Kechikish gistogrammasi chegaralari (soniya)
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+class Metrics:
+    """Vaqt o'lchovlari (span) gistogrammalari
+
+    Har bir nom uchun LATENCY_BUCKETS bo'yicha hisoblagichlar, umumiy soni va yig'indisi
+    saqlanadi. collect() ichida joriy oqimdagi o'lchovlar ro'yxati ham yig'iladi
+    (Streamlit har bir sessiya skriptini o'z oqimida bajaradi).
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.local = threading.local()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = {'counts': [0] * (len(self.buckets) + 1), 'soni': 0, 'yigindi': 0.0}
+            histogram['counts'][bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram['soni'] += 1
+            histogram['yigindi'] += seconds
+
+    @contextmanager
+    def span(self, name, **fields):
+        span = {'nom': name, **fields}
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span['soniya'] = time.perf_counter() - start
+            self.observe(name, span['soniya'])
+            spans = getattr(self.local, 'spans', None)
+            if spans is not None:
+                spans.append(span)
+
+    @contextmanager
+    def collect(self):
+        self.local.spans = []
+        try:
+            yield self.local.spans
+        finally:
+            self.local.spans = None
+
+    def snapshot(self):
+        with self.lock:
+            return {name: {**h, 'counts': list(h['counts'])} for name, h in self.histograms.items()}
+
+    def quantile(self, histogram, q):
+        """Gistogramma bo'yicha taxminiy kvantil (bucket yuqori chegarasi)"""
+        target = q * histogram['soni']
+        total = 0
+        for bound, count in zip(self.buckets + [float('inf')], histogram['counts']):
+            total += count
+            if total >= target:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        return pd.DataFrame([
+            {
+                'nom': name,
+                'soni': h['soni'],
+                'ortacha_ms': h['yigindi'] / h['soni'] * 1000,
+                'p50_ms': self.quantile(h, 0.5) * 1000,
+                'p95_ms': self.quantile(h, 0.95) * 1000
+            }
+            for name, h in sorted(self.snapshot().items())
+        ], columns=['nom', 'soni', 'ortacha_ms', 'p50_ms', 'p95_ms'])
+
+    def prometheus(self):
+        """Prometheus matn formati (histogram turi)"""
+        lines = [
+            "# HELP ombor_span_seconds Asosiy amallar davomiyligi",
+            "# TYPE ombor_span_seconds histogram"
+        ]
+        for name, h in sorted(self.snapshot().items()):
+            total = 0
+            for bound, count in zip(self.buckets + [float('inf')], h['counts']):
+                total += count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f'ombor_span_seconds_bucket{{span="{name}",le="{le}"}} {total}')
+            lines.append(f'ombor_span_seconds_sum{{span="{name}"}} {h["yigindi"]}')
+            lines.append(f'ombor_span_seconds_count{{span="{name}"}} {h["soni"]}')
+        return "\n".join(lines) + "\n"
+
+    def json_lines(self):
+        return "".join(json.dumps({'nom': name, 'chegaralar': self.buckets, **h}) + "\n" for name, h in sorted(self.snapshot().items()))
+
+class DataCache:
+    """Barcha sessiyalar uchun umumiy inventar keshi"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generations = {}
+        self.entries = {}
+        self.load_locks = {}
+
+    def _cached(self, storage):
+        with self.lock:
+            key = (self.generations.get(storage.filename, 0), storage.signature())
+            cached = self.entries.get(storage.filename)
+            return key, (cached[1] if cached is not None and cached[0] == key else None)
+
+    def get(self, storage):
+        key, df = self._cached(storage)
+        if df is not None:
+            return df
+        # O'qish faqat shu fayl qulfi ostida: bir do'kon yuklanayotganda boshqa do'konlar kutmaydi
+        with self.lock:
+            load_lock = self.load_locks.setdefault(storage.filename, threading.Lock())
+        with load_lock:
+            # Kutish paytida boshqa sessiya yuklab bo'lgan bo'lishi mumkin
+            key, df = self._cached(storage)
+            if df is not None:
+                return df
+            # Imzo o'qishdan oldin olinadi: o'qish paytidagi yozuv keyingi safar sezilib qoladi
+            df = compact_dtypes(storage.load())
+            with self.lock:
+                self.entries[storage.filename] = (key, df, {})
+            return df
+
+    def get_merged(self, key, build):
+        # Bir nechta fayldan yig'ilgan jadval: kalit (fayllar versiyalari) o'zgarganda qayta yig'iladi
+        with self.lock:
+            cached = self.entries.get(ALL_STORES)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        df = build()
+        with self.lock:
+            self.entries[ALL_STORES] = (key, df, {})
+        return df
+
+    def derived(self, entry, df, name, build):
+        # df dan hosil qilingan tuzilmalar (indekslar) keshi: ma'lumot o'zgarganda birga yangilanadi
+        with self.lock:
+            cached = self.entries.get(entry)
+            if cached is None or cached[1] is not df:
+                return build(df)
+            if name not in cached[2]:
+                cached[2][name] = build(df)
+            return cached[2][name]
+
+    def version(self, storage):
+        with self.lock:
+            return (self.generations.get(storage.filename, 0), storage.signature())
+
+    def invalidate(self, storage):
+        # Faqat shu fayl keshi eskiradi: boshqa do'konlar ma'lumotlari qayta o'qilmaydi
+        with self.lock:
+            self.generations[storage.filename] = self.generations.get(storage.filename, 0) + 1
+            self.entries.pop(storage.filename, None)